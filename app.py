@@ -1,17 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, abort
+from flask import (Flask, render_template, request, redirect, url_for, flash, send_file, abort, jsonify,
+                   Response, stream_with_context, g, has_request_context)
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import configparser
+import os
+import csv
+import click
 from models import db, User, Client, BookType, Book, Journal
-import re
+from queries import (clients_query, books_query, journal_query, with_availability, init_query_budget,
+                     data_version_statement)
+from pagination import KeysetPagination, keyset_page
+from issuing import IssueError, issue_book, issue_books, return_books, run_stress
+from migrations import apply_migrations
+from validators import validate_client
+from importer import import_clients, import_books
+from reports import (get_client_books_count, get_client_fine, get_max_fine, get_top_books,
+                     refresh_report_views, reconcile_client_summary, ReportViewsRefresher,
+                     refresh_overdue_snapshot, discard_overdue, reprice_overdue, reprice_overdue_type,
+                     overdue_snapshot_query, overdue_snapshot_totals, create_journal_partitions_ahead, archive_journal)
+from cache import TTLCache, ResultCache
+from references import book_type_cache, get_book_types, invalidate_book_types
+from metrics import Metrics
+from pdf import init_pdf, PdfReport
+from jobs import ReportJobs, JobQueueFull, DONE
+from benchmark import generate_library, run_benchmark, save_baseline, load_baseline, compare_baselines
+from explain import check_plans
+from search import (CLIENT_SEARCH_FIELDS, LOOKUP_LIMIT, LOOKUP_MAX_LIMIT, search_filter, order_by_relevance,
+                    create_search_indexes, lookup_clients, lookup_books, client_label, book_label,
+                    JOURNAL_SEARCH_COLUMNS, journal_search_filter, BOOK_SEARCH_COLUMNS, book_search_filter,
+                    catalog_page_statement)
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, text
+from sqlalchemy import func, text
+from sqlalchemy.engine import URL
+from werkzeug.http import is_resource_modified
 from io import StringIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 from functools import wraps
 
 app = Flask(__name__)
@@ -21,14 +44,81 @@ app.config['SECRET_KEY'] = 'your-secret-key'
 config = configparser.ConfigParser()
 config.read('config/database.ini')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['postgresql']['user']}:{config['postgresql']['password']}@{config['postgresql']['host']}/{config['postgresql']['database']}"
+def database_uri(section, defaults=None):
+    # Параметры, не заданные в секции, берутся из defaults (для реплики - из основной базы)
+    defaults = defaults or {}
+    value = lambda key: section.get(key, defaults.get(key))
+    return URL.create(
+        'postgresql',
+        username=value('user'),
+        password=value('password'),
+        host=value('host'),
+        port=int(value('port')) if value('port') else None,
+        database=value('database')
+    ).render_as_string(hide_password=False)
+
+# Адрес основной базы можно задать переменной окружения DATABASE_URL (так ее задают тесты)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or database_uri(config['postgresql'])
+
+# Реплика только для чтения: на нее идут маршруты с декоратором read_only
+if config.has_section('replica') and config['replica'].get('host'):
+    app.config['SQLALCHEMY_BINDS'] = {'replica': database_uri(config['replica'], config['postgresql'])}
+
+# Пул подключений и ограничение времени выполнения запроса (секция [pool]).
+# Ограничение действует только при обработке HTTP-запросов, см. lift_statement_timeout
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': config.getint('pool', 'pool_size', fallback=10),
+    'max_overflow': config.getint('pool', 'max_overflow', fallback=20),
+    'pool_timeout': config.getint('pool', 'pool_timeout', fallback=30),
+    'pool_recycle': config.getint('pool', 'pool_recycle', fallback=1800),
+    'pool_pre_ping': config.getboolean('pool', 'pool_pre_ping', fallback=True),
+    'connect_args': {
+        'options': f"-c statement_timeout={config.getint('pool', 'statement_timeout', fallback=30000)}"
+    }
+}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Число строк журнала, читаемых с сервера за раз при выгрузке в CSV
+app.config['JOURNAL_EXPORT_CHUNK_SIZE'] = 1000
+# Число строк, читаемых с сервера за раз при построении больших PDF-отчетов
+app.config['PDF_ROWS_CHUNK_SIZE'] = 1000
+# Режим постраничного вывода: 'offset' (номера страниц) или 'keyset' (по курсору, без OFFSET)
+app.config['PAGINATION_MODE'] = 'offset'
+# Общее число записей в режиме keyset: 'estimate' (по статистике), 'exact' или 'none'
+app.config['PAGINATION_TOTAL'] = 'estimate'
+# Возвращенные раньше стольких дней назад записи журнала переносятся в архив (flask archive-journal)
+app.config['JOURNAL_ARCHIVE_AFTER_DAYS'] = 365
 
 # Инициализация расширен
 db.init_app(app)
+init_query_budget(app)
+
+@db.event.listens_for(db.session, 'after_begin')
+def lift_statement_timeout(session, transaction, connection):
+    # Команды flask (миграции, снимок просрочек, сводка, архив журнала) и фоновые потоки
+    # (обновление представлений, построение отчетов) обрабатывают всю базу и не должны
+    # прерываться по statement_timeout, рассчитанному на запросы пользователей
+    if not has_request_context():
+        connection.exec_driver_sql('SET LOCAL statement_timeout = 0')
+
+# Время запросов и SQL по каждому view: заголовок Server-Timing, /metrics и лог медленных запросов
+metrics = Metrics(app)
+# Шрифт с кириллицей для PDF-отчетов регистрируется один раз
+init_pdf(app)
+report_views = ReportViewsRefresher(app)
+# Готовые отчеты; ключ включает версию данных из базы (data_version), она увеличивается при изменении
+# журнала и справочников и после обновления представлений
+report_cache = ResultCache(app, get_version=lambda: data_version().version)
+# Фоновое построение отчетов в пуле потоков, состояние заданий общее для всех процессов (таблица report_jobs)
+report_jobs = ReportJobs(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+def data_version():
+    # Строка data_version читается один раз за запрос (или за фоновое задание отчета)
+    if 'data_version' not in g:
+        g.data_version = db.session.execute(data_version_statement()).one()
+    return g.data_version
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -38,9 +128,55 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Справочник типов книг (срок выдачи, штраф) без запроса к базе
+book_type_cache.init_app(app)
+# Пользователи для login_manager: запрос к базе только при первом обращении или после изменения.
+# Кэш свой в каждом процессе: изменение пользователя сразу видно в процессе, который его сохранил,
+# а в остальных - не позже чем через USER_CACHE_TTL секунд (смена роли, пароля, удаление)
+user_cache = TTLCache(app, prefix='USER_CACHE', max_size=1024, ttl=60)
+
+def read_only(f):
+    # Маршрут только читает данные - запросы можно отправлять на реплику
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    data = user_cache.get(user_id)
+    if data is None:
+        user = db.session.get(User, int(user_id))
+        if user is None:
+            return None
+        data = {
+            'id': user.id,
+            'username': user.username,
+            'password_hash': user.password_hash,
+            'role': user.role
+        }
+        user_cache.set(user_id, data)
+    # Отдаем новый объект, не привязанный к сессии, чтобы кэш не делился объектами между потоками
+    return User(**data)
+
+@db.event.listens_for(db.session, 'after_flush')
+def remember_changed_users(session, flush_context):
+    # Смена роли или пароля, удаление пользователя. Из кэша запись удаляется после фиксации
+    # транзакции: при удалении во время flush параллельный запрос успел бы прочитать
+    # еще не измененную строку и снова закэшировать ее
+    changed = session.info.setdefault('changed_users', set())
+    changed.update(str(obj.id) for obj in (*session.new, *session.dirty, *session.deleted)
+                   if isinstance(obj, User))
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_cached_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.pop(user_id)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_changed_users(session):
+    session.info.pop('changed_users', None)
 
 # Маршруты для клиентов
 @app.route('/references/clients')
@@ -48,13 +184,13 @@ def load_user(user_id):
 @admin_required
 def clients_list():
     page = request.args.get('page', 1, type=int)
-    sort_by = request.args.get('sort_by', 'id')
+    sort_by = request.args.get('sort_by', DEFAULT_SORT)
     search = request.args.get('search', '')
     
-    query = Client.query
-    query = apply_search(query, search, Client, ['last_name', 'first_name', 'father_name', 'passport_seria', 'passport_number'])
+    query = clients_query()
+    query = apply_search(query, search, Client, CLIENT_SEARCH_FIELDS, sort_by)
     query = apply_sorting(query, sort_by, Client)
-    pagination = get_pagination(query, page)
+    pagination = get_pagination(query, page, sort_column=get_sort_column(Client, sort_by))
     
     return render_template('references/clients.html', 
                          pagination=pagination,
@@ -72,29 +208,9 @@ def client_add():
         passport_seria = request.form['passport_seria']
         passport_number = request.form['passport_number']
         
-        # Паттерн для проверки кириллицы
-        cyrillic_pattern = re.compile(r'^[А-Яа-яЁё\s-]+$')
-        
-        # Валидация ФИО
-        if not cyrillic_pattern.match(last_name):
-            flash('Фамилия должна содержать только кириллицу')
-            return render_template('references/client_form.html')
-            
-        if not cyrillic_pattern.match(first_name):
-            flash('Имя должно содержать только кириллицу')
-            return render_template('references/client_form.html')
-            
-        if father_name and not cyrillic_pattern.match(father_name):
-            flash('Отчество должно содержать только кириллицу')
-            return render_template('references/client_form.html')
-        
-        # Валидация паспортных данных
-        if len(passport_seria) != 4 or not passport_seria.isdigit():
-            flash('Серия паспорта должна состоять из 4 цифр')
-            return render_template('references/client_form.html')
-            
-        if len(passport_number) != 6 or not passport_number.isdigit():
-            flash('Номер паспорта должен состоять из 6 цифр')
+        error = validate_client(last_name, first_name, father_name, passport_seria, passport_number)
+        if error:
+            flash(error)
             return render_template('references/client_form.html')
             
         client = Client(
@@ -130,8 +246,13 @@ def login():
 
 @app.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
-    return render_template('dashboard.html')
+    # Просрочки из снимка: число, сумма штрафов и записи с наибольшим штрафом
+    overdue = overdue_snapshot_totals()
+    top_overdue = overdue_snapshot_query().limit(10).all()
+    return render_template('dashboard.html', overdue=overdue, top_overdue=top_overdue,
+                           today=datetime.now().date())
 
 @app.route('/logout')
 @login_required
@@ -139,6 +260,12 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+@app.route('/metrics')
+@login_required
+@admin_required
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 def create_default_users():
     if User.query.count() == 0:
         admin = User(
@@ -157,6 +284,37 @@ def create_default_users():
         db.session.add(user)
         db.session.commit()
 
+@app.route('/references/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def references_import():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Выберите CSV-файл')
+            return render_template('references/import_form.html')
+        
+        # Файл читается потоком, а не целиком в память
+        stream = TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            if kind == 'clients':
+                result = import_clients(stream)
+            elif kind == 'books':
+                result = import_books(stream)
+            else:
+                abort(400)
+        except ValueError as e:
+            flash(str(e))
+            return render_template('references/import_form.html')
+        
+        report_data_changed()
+        flash(f'Загружено: {result.inserted}, дубликатов: {result.duplicates}, с ошибками: {result.invalid}')
+        for error in result.errors:
+            flash(error)
+        return redirect(url_for('clients_list' if kind == 'clients' else 'books_list'))
+    return render_template('references/import_form.html')
+
 @app.route('/references/clients/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def client_edit(id):
@@ -168,6 +326,7 @@ def client_edit(id):
         client.passport_seria = request.form['passport_seria']
         client.passport_number = request.form['passport_number']
         db.session.commit()
+        report_data_changed()
         flash('Клиент успешно обновлен')
         return redirect(url_for('clients_list'))
     return render_template('references/client_form.html', client=client)
@@ -178,23 +337,22 @@ def client_delete(id):
     client = Client.query.get_or_404(id)
     db.session.delete(client)
     db.session.commit()
+    report_data_changed()
     flash('Клиент успешно дален')
     return redirect(url_for('clients_list'))
 
 @app.route('/books')
 @login_required
+@read_only
 def books_list():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
-    sort_by = request.args.get('sort_by', 'id')
-    
-    query = Book.query.join(BookType)
-    
-    if search:
-        query = query.filter(Book.name.ilike(f'%{search}%'))
+    sort_by = request.args.get('sort_by', DEFAULT_SORT)
     
+    query = books_query()
+    query = apply_column_search(query, search, [Book.name], sort_by)
     query = apply_sorting(query, sort_by, Book)
-    pagination = get_pagination(query, page)
+    pagination = get_pagination(query, page, sort_column=get_sort_column(Book, sort_by))
     
     return render_template('books/list.html',
                          books=pagination.items,
@@ -208,7 +366,7 @@ def books_list():
 @admin_required
 def book_types_list():
     search = request.args.get('search', '')
-    sort_by = request.args.get('sort_by', 'id')
+    sort_by = request.args.get('sort_by', DEFAULT_SORT)
     page = request.args.get('page', 1, type=int)
     
     query = BookType.query
@@ -242,10 +400,10 @@ def books_add():
         name = request.form['name']
         
         # Проверям существование книги с таким названием
-        existing_book = Book.query.filter(Book.name.ilike(name)).first()
+        existing_book = Book.query.filter(func.lower(Book.name) == name.lower()).first()
         if existing_book:
             flash('Книга с таким названием уже существует', 'error')
-            book_types = BookType.query.all()
+            book_types = list(get_book_types().values())
             return render_template('references/book_form.html', book_types=book_types)
             
         book = Book(
@@ -255,10 +413,11 @@ def books_add():
         )
         db.session.add(book)
         db.session.commit()
+        report_data_changed()
         flash('Книга успешно добавлена')
         return redirect(url_for('books_list'))
         
-    book_types = BookType.query.all()
+    book_types = list(get_book_types().values())
     return render_template('references/book_form.html', book_types=book_types)
 
 @app.route('/books/<int:id>/edit', methods=['GET', 'POST'])
@@ -269,11 +428,15 @@ def books_edit(id):
     if request.method == 'POST':
         book.name = request.form['name']
         book.cnt = request.form['cnt']
+        type_changed = book.type_id != int(request.form['type_id'])
         book.type_id = request.form['type_id']
+        if type_changed:
+            reprice_overdue(book.id)
         db.session.commit()
+        report_data_changed()
         flash('Книга успешно обновлена')
         return redirect(url_for('books_list'))
-    book_types = BookType.query.all()
+    book_types = list(get_book_types().values())
     return render_template('references/book_form.html', book=book, book_types=book_types)
 
 @app.route('/references/books/<int:id>/delete')
@@ -282,36 +445,53 @@ def book_delete(id):
     book = Book.query.get_or_404(id)
     db.session.delete(book)
     db.session.commit()
+    report_data_changed()
     flash('Книга успешно удалена')
     return redirect(url_for('books_list'))
 
+# Фильтры журнала по состоянию записи
+JOURNAL_STATUS_FILTERS = {
+    'open': Journal.is_open,
+    'returned': Journal.date_ret.isnot(None),
+    'overdue': Journal.is_overdue,
+    'fined': Journal.fine > 0,
+}
+
 @app.route('/journal')
 @login_required
 @admin_required
 def journal_list():
     page = request.args.get('page', 1, type=int)
-    sort_by = request.args.get('sort_by', 'id')
+    sort_by = request.args.get('sort_by', DEFAULT_SORT)
     search = request.args.get('search', '')
     
-    query = Journal.query
-    if search:
-        query = query.join(Client).join(Book).filter(
-            db.or_(
-                Client.last_name.ilike(f'%{search}%'),
-                Client.first_name.ilike(f'%{search}%'),
-                Book.name.ilike(f'%{search}%')
-            )
-        )
+    status = request.args.get('status', '')
+    min_fine = request.args.get('min_fine', type=float)
+    # Архив (давно возвращенные книги) показывается только по запросу
+    archive = request.args.get('archive', type=int)
     
-    if sort_by and hasattr(Journal, sort_by):
-        query = query.order_by(getattr(Journal, sort_by))
-    
-    pagination = get_pagination(query, page)
+    query = journal_query()
+    if not archive:
+        query = query.filter(Journal.archived.is_(False))
+    if search:
+        query = query.filter(journal_search_filter(search))
+        if sort_by == DEFAULT_SORT:
+            query = order_by_relevance(query, search, JOURNAL_SEARCH_COLUMNS)
+    # Фильтры по состоянию и штрафу выполняются в базе
+    if status in JOURNAL_STATUS_FILTERS:
+        query = query.filter(JOURNAL_STATUS_FILTERS[status])
+    if min_fine is not None:
+        query = query.filter(Journal.fine >= min_fine)
+    query = apply_sorting(query, sort_by, Journal)
+    pagination = get_pagination(query, page, sort_column=get_sort_column(Journal, sort_by))
     
     return render_template('journals/journal.html',
                          pagination=pagination,
                          sort_by=sort_by,
-                         search=search)
+                         search=search,
+                         status=status,
+                         min_fine=min_fine,
+                         archive=archive)
 
 @app.route('/journal/add', methods=['GET', 'POST'])
 @login_required
@@ -320,69 +500,45 @@ def journal_add():
         client_id = request.form['client_id']
         book_id = request.form['book_id']
         
-        # Проверяем количество книг у клиента
-        client_books = Journal.query.filter_by(
-            client_id=client_id, 
-            date_ret=None
-        ).count()
-        
-        if client_books >= 10:
-            flash('Клиент не может взять больше 10 книг', 'error')
-            return redirect(url_for('journal_add'))
-        
-        # Проверяем доступность книги
-        book = Book.query.get_or_404(book_id)
-        
-        # Проверяем реальное количество доступных экземпляров
-        issued_books = Journal.query.filter_by(
-            book_id=book_id,
-            date_ret=None
-        ).count()
-        
-        if issued_books >= book.cnt:
-            flash('Книга недоступна для выдачи (все экземпляры на руках)', 'error')
-            return redirect(url_for('journal_add'))
-        
         try:
-            date_beg = datetime.strptime(request.form['date_beg'], '%Y-%m-%d')
-            date_end = date_beg + timedelta(days=book.book_type.day_count)
-            
-            journal = Journal(
-                client_id=client_id,
-                book_id=book_id,
-                date_beg=date_beg,
-                date_end=date_end
-            )
-            
-            db.session.add(journal)
-            db.session.commit()
-            
-            flash('Книга успешно выдана')
-            return redirect(url_for('journal_list'))
-            
+            date_beg = datetime.strptime(request.form['date_beg'], '%Y-%m-%d').date()
+            # Лимиты клиента и наличие книги проверяются в той же транзакции, что и вставка
+            issue_book(int(client_id), int(book_id), date_beg)
+        except IssueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('journal_add'))
         except Exception as e:
             db.session.rollback()
             flash('Произошла ошибка при выдаче книги', 'error')
             return redirect(url_for('journal_add'))
+        
+        report_data_changed()
+        flash('Книга успешно выдана')
+        return redirect(url_for('journal_list'))
     
-    # Получаем список доступных книг с реальным количеством
-    available_books = Book.query.all()
-    for book in available_books:
-        issued = Journal.query.filter_by(
-            book_id=book.id,
-            date_ret=None
-        ).count()
-        book.available = book.cnt - issued
-    
-    available_books = [book for book in available_books if book.available > 0]
-    
-    clients = Client.query.order_by(Client.last_name).all()
+    # Клиент и книга выбираются через подсказки (lookup_clients_json, lookup_books_json),
+    # поэтому форма не зависит от размера справочников
     today = datetime.now().strftime('%Y-%m-%d')
     
-    return render_template('journals/journal_form.html',
-                         clients=clients,
-                         available_books=available_books,
-                         today=today)
+    return render_template('journals/journal_form.html', today=today)
+
+def lookup_limit():
+    return min(max(request.args.get('limit', LOOKUP_LIMIT, type=int), 1), LOOKUP_MAX_LIMIT)
+
+@app.route('/lookup/clients')
+@login_required
+@read_only
+def lookup_clients_json():
+    clients = lookup_clients(request.args.get('q', ''), lookup_limit())
+    return jsonify([{'id': client.id, 'label': client_label(client)} for client in clients])
+
+@app.route('/lookup/books')
+@login_required
+@read_only
+def lookup_books_json():
+    book_types = get_book_types()
+    books = lookup_books(request.args.get('q', ''), lookup_limit())
+    return jsonify([{'id': book.id, 'label': book_label(book, book_types.get(book.type_id))} for book in books])
 
 @app.route('/journal/<int:id>/return')
 @login_required
@@ -391,77 +547,151 @@ def journal_return(id):
     if not journal.date_ret:
         try:
             journal.date_ret = datetime.now()
+            discard_overdue([journal.id])
             db.session.commit()
+            report_data_changed()
             flash('Книга успешно возвращена')
         except Exception as e:
             db.session.rollback()
             flash('Ошибка при возврате книги', 'error')
     return redirect(url_for('journal_list'))
 
+@app.route('/journal/batch/issue', methods=['POST'])
+@login_required
+def journal_batch_issue():
+    # JSON: {"date_beg": "2024-01-31", "items": [{"client_id": 1, "book_id": 2}, ...]}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items', []), list):
+        abort(400)
+    try:
+        items = [(int(item['client_id']), int(item['book_id'])) for item in data.get('items', [])]
+        date_beg = datetime.strptime(data['date_beg'], '%Y-%m-%d').date() if data.get('date_beg') \
+            else datetime.now().date()
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    if not items:
+        abort(400)
+    
+    results = issue_books(items, date_beg)
+    issued = sum(1 for result in results if result['ok'])
+    if issued:
+        report_data_changed()
+    return jsonify(results=results, issued=issued)
+
+@app.route('/journal/batch/return', methods=['POST'])
+@login_required
+def journal_batch_return():
+    # JSON {"ids": [1, 2, 3]} или форма со списком отмеченных записей журнала
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('ids', []), list):
+            abort(400)
+        ids = data.get('ids', [])
+    else:
+        ids = request.form.getlist('ids')
+    try:
+        ids = [int(id) for id in ids]
+    except (TypeError, ValueError):
+        abort(400)
+    
+    results = return_books(ids, datetime.now().date()) if ids else []
+    returned = sum(1 for result in results if result['ok'])
+    if returned:
+        report_data_changed()
+    
+    if request.is_json:
+        return jsonify(results=results, returned=returned)
+    if returned:
+        flash(f'Возвращено книг: {returned}')
+    if returned < len(results):
+        flash(f'Не удалось вернуть книг: {len(results) - returned}', 'error')
+    return redirect(url_for('journal_list'))
+
 @app.route('/journal/<int:id>/delete', methods=['POST'])
 @login_required
 @admin_required
 def journal_delete(id):
     journal = Journal.query.get_or_404(id)
     db.session.delete(journal)
+    discard_overdue([journal.id])
     db.session.commit()
+    report_data_changed()
     flash('Запись успешно удалена')
     return redirect(url_for('journal_list'))
 
-def get_pagination(query, page, per_page=10):
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    return pagination
+def report_data_changed():
+    # Журнал, справочники или штрафы изменились - представления нужно обновить.
+    # Версию данных для кэша отчетов и ETag в API увеличивают триггеры в базе
+    report_views.mark_stale()
+
+def get_pagination(query, page, per_page=10, sort_column=None):
+    # Параметр after (курсор) включает постраничный вывод по ключу для любого списка
+    after = request.args.get('after')
+    if after is None and app.config['PAGINATION_MODE'] != 'keyset':
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        return pagination
+    
+    model = query.column_descriptions[0]['entity']
+    return KeysetPagination(query,
+                            sort_column if sort_column is not None else model.id,
+                            model.id,
+                            after=after,
+                            per_page=per_page,
+                            total=app.config['PAGINATION_TOTAL'])
+
+# Вычисляемые колонки, по которым тоже можно сортировать
+SORTABLE_PROPERTIES = {Journal: ['fine']}
+
+# Сортировка списков по умолчанию; при поиске она означает "сначала наиболее подходящие"
+DEFAULT_SORT = 'id'
+
+def get_sort_column(model, sort_by):
+    if sort_by and (sort_by in model.__table__.columns or sort_by in SORTABLE_PROPERTIES.get(model, [])):
+        return getattr(model, sort_by)
+    return None
 
 def apply_sorting(query, sort_by, model):
-    if sort_by and hasattr(model, sort_by):
-        return query.order_by(getattr(model, sort_by))
+    column = get_sort_column(model, sort_by)
+    if column is not None:
+        # id при равных значениях: иначе строки на соседних страницах могут повторяться
+        return query.order_by(column, model.id) if column is not model.id else query.order_by(column)
     return query
 
-def apply_search(query, search_text, model, search_fields):
-    if search_text:
-        search_filters = []
-        for field in search_fields:
-            if hasattr(model, field):
-                search_filters.append(getattr(model, field).ilike(f'%{search_text}%'))
-        if search_filters:
-            query = query.filter(db.or_(*search_filters))
+def apply_search(query, search_text, model, search_fields, sort_by=DEFAULT_SORT):
+    columns = [getattr(model, field) for field in search_fields if hasattr(model, field)]
+    return apply_column_search(query, search_text, columns, sort_by)
+
+def apply_column_search(query, search_text, columns, sort_by=DEFAULT_SORT):
+    if search_text and columns:
+        query = query.filter(search_filter(search_text, columns))
+        # При сортировке по умолчанию сначала выводим наиболее подходящие записи, при равной
+        # похожести - по id (apply_sorting). Ссылки на страницы передают тот же sort_by,
+        # поэтому порядок на всех страницах одинаковый.
+        if sort_by == DEFAULT_SORT:
+            query = order_by_relevance(query, search_text, columns)
     return query
 
 @app.route('/reports')
 @login_required
 @admin_required
 def reports():
-    clients = Client.query.order_by(Client.last_name).all()
-    return render_template('reports/index.html', clients=clients)
+    # Клиент для отчета и выгрузки выбирается по подсказкам (/lookup/clients), а не из списка всех клиентов
+    return render_template('reports/index.html')
 
 @app.route('/reports/library_stats')
 @login_required
+@read_only
 def library_stats():
-    # Размер самого большого штрафа - используем структуру из документации
-    max_fine = db.session.query(
-        func.max((Journal.date_ret - Journal.date_end) * BookType.fine)
-    ).select_from(Journal).join(
-        Book, 
-        Journal.book_id == Book.id
-    ).join(
-        BookType,
-        Book.type_id == BookType.id
-    ).filter(
-        Journal.date_ret > Journal.date_end
-    ).scalar() or 0
-    
-    # Три самые популярные кнг
-    popular_books = db.session.query(
-        Book.name,
-        func.count(Book.name).label('count')
-    ).join(
-        Journal,
-        Book.id == Journal.book_id
-    ).group_by(
-        Book.name
-    ).order_by(
-        func.count(Book.name).desc()
-    ).limit(3).all()
+    output = report_cache.get_or_compute('library_stats', render_library_stats_csv)
+    return output, 200, {
+        'Content-Type': 'text/csv; charset=utf-8',
+        'Content-Disposition': 'attachment; filename=library_stats.csv'
+    }
+
+def render_library_stats_csv():
+    # Размер самого большого штрафа и три самые популярные книги - из хранимых функций
+    max_fine = get_max_fine()
+    popular_books = get_top_books(3)
     
     # Формируем отчет
     output = StringIO()
@@ -473,194 +703,233 @@ def library_stats():
     for book, count in popular_books:
         writer.writerow([book, count])
     
-    return output.getvalue(), 200, {
-        'Content-Type': 'text/csv; charset=utf-8',
-        'Content-Disposition': 'attachment; filename=library_stats.csv'
-    }
-
-def create_pdf_report(data, title):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    
-    # Настройка шрифта для подерки кириллицы
-    pdfmetrics.registerFont(TTFont('Arial', 'arial.ttf'))
-    p.setFont('Arial', 14)
-    
-    # Заголовок
-    p.drawString(50, 800, title)
-    p.setFont('Arial', 12)
-    
-    y = 750
-    for line in data:
-        p.drawString(50, y, str(line))
-        y -= 20
-        
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    return buffer
+    return output.getvalue()
 
-@app.route('/reports/client_books_pdf/<int:client_id>')
+@app.route('/reports/journal_export')
 @login_required
-def client_books_report_pdf(client_id):
-    # Число книг на руках
-    books_count = Journal.query.filter(
-        Journal.client_id == client_id,
-        Journal.date_ret.is_(None)
-    ).count()
-    
-    # Размер штрафа клиента
-    client_fine = db.session.query(
-        func.sum((Journal.date_ret - Journal.date_end) * BookType.fine)
-    ).select_from(Journal).join(
-        Book, 
+@admin_required
+@read_only
+def journal_export():
+    # Полная история журнала в CSV. Строки читаются с сервера порциями (серверный курсор)
+    # и сразу отправляются клиенту, поэтому выгрузка не держит весь журнал в памяти.
+    try:
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date() \
+            if request.args.get('date_from') else None
+        date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d').date() \
+            if request.args.get('date_to') else None
+    except ValueError:
+        abort(400)
+    client_id = request.args.get('client_id', type=int)
+    
+    query = db.session.query(
+        Journal.id,
+        Client.last_name,
+        Client.first_name,
+        Client.father_name,
+        Client.passport_seria,
+        Client.passport_number,
+        Book.name,
+        BookType.type,
+        Journal.date_beg,
+        Journal.date_end,
+        Journal.date_ret,
+        (Journal.days_overdue * BookType.fine).label('fine')
+    ).join(
+        Client,
+        Journal.client_id == Client.id
+    ).join(
+        Book,
         Journal.book_id == Book.id
     ).join(
         BookType,
         Book.type_id == BookType.id
-    ).filter(
-        Journal.client_id == client_id,
-        Journal.date_ret > Journal.date_end
-    ).scalar() or 0
-    
-    client = Client.query.get_or_404(client_id)
-    
-    # Создаем PDF с подержкой кириллицы
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
+    )
     
-    # Регистрируем шрифт с поддержкой кириллицы
-    pdfmetrics.registerFont(TTFont('Arial', 'arial.ttf'))
-    p.setFont('Arial', 14)
+    if date_from:
+        query = query.filter(Journal.date_beg >= date_from)
+    if date_to:
+        query = query.filter(Journal.date_beg <= date_to)
+    if client_id:
+        query = query.filter(Journal.client_id == client_id)
     
-    # Используем кириллицу в тексте
-    p.drawString(50, 800, 'Отчет по клиенту')
-    p.drawString(50, 770, f'ФИО: {client.last_name} {client.first_name} {client.father_name}')
-    p.drawString(50, 740, f'Книг на руках: {books_count}')
-    p.drawString(50, 710, f'Общий штраф: {float(client_fine)} руб.')
+    chunk_size = app.config['JOURNAL_EXPORT_CHUNK_SIZE']
+    query = query.order_by(Journal.id).yield_per(chunk_size)
     
-    p.showPage()
-    p.save()
+    def generate():
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['ID', 'Фамилия', 'Имя', 'Отчество', 'Серия паспорта', 'Номер паспорта',
+                         'Книга', 'Тип книги', 'Дата выдачи', 'Срок возврата', 'Дата возврата', 'Штраф'])
+        for i, row in enumerate(query, start=1):
+            writer.writerow(row)
+            if i % chunk_size == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
     
+    return Response(stream_with_context(generate()), headers={
+        'Content-Type': 'text/csv; charset=utf-8',
+        'Content-Disposition': 'attachment; filename=journal.csv'
+    })
+
+def report_job_spec(report):
+    # Отчет для фонового построения: ключ задания, функция построения, имя файла и тип.
+    # В ключ входит версия данных, чтобы после изменения журнала не получить старое задание.
+    version = report_cache.version
+    if report == 'library_stats':
+        return ((report, version),
+                lambda: report_cache.get_or_compute('library_stats', render_library_stats_csv),
+                'library_stats.csv', 'text/csv; charset=utf-8')
+    if report == 'library_stats_pdf':
+        return ((report, version),
+                lambda: report_cache.get_or_compute('library_stats_pdf', render_library_stats_pdf),
+                'library_stats.pdf', 'application/pdf')
+    if report == 'overdue_books_pdf':
+        today = datetime.now().date()
+        return ((report, version, today),
+                lambda: report_cache.get_or_compute(('overdue_books_pdf', today), render_overdue_books_pdf),
+                'overdue_books.pdf', 'application/pdf')
+    if report == 'client_books_pdf':
+        client_id = request.values.get('client_id', type=int)
+        if not client_id or db.session.get(Client, client_id) is None:
+            abort(404)
+        return ((report, version, client_id),
+                lambda: render_client_books_pdf(client_id),
+                f'client_report_{client_id}.pdf', 'application/pdf')
+    abort(404)
+
+def report_job_status(job):
+    status = job.as_dict()
+    if job.status == DONE:
+        status['download_url'] = url_for('report_job_download', job_id=job.id)
+    return status
+
+@app.route('/reports/<report>/job', methods=['POST'])
+@login_required
+def report_job_start(report):
+    try:
+        job = report_jobs.submit(*report_job_spec(report))
+    except JobQueueFull:
+        return jsonify(error='Очередь отчетов заполнена, повторите попытку позже'), 503, {'Retry-After': '5'}
+    return jsonify(report_job_status(job)), 202
+
+@app.route('/reports/jobs/<job_id>')
+@login_required
+def report_job(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(report_job_status(job))
+
+@app.route('/reports/jobs/<job_id>/download')
+@login_required
+def report_job_download(job_id):
+    job = report_jobs.get(job_id)
+    if job is None or job.status != DONE:
+        abort(404)
+    return send_file(job.path, as_attachment=True, download_name=job.download_name, mimetype=job.mimetype)
+
+def create_pdf_report(data, title):
+    buffer = BytesIO()
+    report = PdfReport(buffer, title)
+    report.lines(data)
+    report.save()
     buffer.seek(0)
+    return buffer
+
+@app.route('/reports/client_books_pdf/<int:client_id>')
+@login_required
+@read_only
+def client_books_report_pdf(client_id):
+    pdf = render_client_books_pdf(client_id)
     return send_file(
-        buffer,
+        BytesIO(pdf),
         as_attachment=True,
         download_name=f'client_report_{client_id}.pdf',
         mimetype='application/pdf'
     )
 
-@app.route('/reports/library_stats_pdf')
-@login_required
-def library_stats_pdf():
-    # Размер самого большого штрафа
-    max_fine = db.session.query(
-        func.max((Journal.date_ret - Journal.date_end) * BookType.fine)
-    ).select_from(Journal).join(
-        Book,
-        Journal.book_id == Book.id
-    ).join(
-        BookType,
-        Book.type_id == BookType.id
-    ).filter(
-        Journal.date_ret > Journal.date_end
-    ).scalar() or 0
+def render_client_books_pdf(client_id):
+    # Число книг на руках и размер штрафа клиента - из сводки по клиенту
+    books_count = get_client_books_count(client_id)
+    client_fine = get_client_fine(client_id)
     
-    # Три самые популярые книги
-    popular_books = db.session.query(
-        Book.name,
-        func.count(Journal.id).label('count')
-    ).join(
-        Journal,
-        Book.id == Journal.book_id
-    ).group_by(
-        Book.name
-    ).order_by(
-        desc('count')
-    ).limit(3).all()
+    client = Client.query.get_or_404(client_id)
     
-    # Создаем PDF с поддержкой кириллицы
+    # Создаем PDF с подержкой кириллицы
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    
-    # Регистрируем шрифт с поддержкой кириллицы
-    pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
-    p.setFont('DejaVuSans', 14)
+    report = PdfReport(buffer, 'Отчет по клиенту', font_size=14, line_height=30)
+    report.line(f'ФИО: {client.last_name} {client.first_name} {client.father_name}')
+    report.line(f'Книг на руках: {books_count}')
+    report.line(f'Общий штраф: {float(client_fine)} руб.')
+    if client.summary and client.summary.last_activity:
+        report.line(f'Последняя операция: {client.summary.last_activity.strftime("%d.%m.%Y")}')
+    report.save()
     
-    # Добавляем данные в PDF
-    p.drawString(50, 800, 'Статистика библиотеки')
-    p.drawString(50, 770, f'Максимальный штраф: {float(max_fine)} руб.')
-    p.drawString(50, 740, 'Самые популярные книги:')
-    
-    y = 710
-    for book, count in popular_books:
-        p.drawString(70, y, f'- {book}: {count} выдач')
-        y -= 30
-    
-    p.showPage()
-    p.save()
-    
-    buffer.seek(0)
+    return buffer.getvalue()
+
+@app.route('/reports/library_stats_pdf')
+@login_required
+@read_only
+def library_stats_pdf():
+    pdf = report_cache.get_or_compute('library_stats_pdf', render_library_stats_pdf)
     return send_file(
-        buffer,
+        BytesIO(pdf),
         as_attachment=True,
         download_name='library_stats.pdf',
         mimetype='application/pdf'
     )
 
-@app.route('/reports/overdue_books_pdf')
-@login_required
-def overdue_books_report_pdf():
-    # Получаем список росроченных книг
-    overdue_books = db.session.query(
-        Journal.id,
-        Client.last_name,
-        Client.first_name,
-        Book.name,
-        Journal.date_end,
-        func.current_date(),
-        ((func.current_date() - Journal.date_end) * BookType.fine).label('fine')
-    ).join(
-        Client,
-        Journal.client_id == Client.id
-    ).join(
-        Book,
-        Journal.book_id == Book.id
-    ).join(
-        BookType,
-        Book.type_id == BookType.id
-    ).filter(
-        Journal.date_ret.is_(None),
-        Journal.date_end < func.current_date()
-    ).order_by(desc('fine')).all()
+def render_library_stats_pdf():
+    # Размер самого большого штрафа и три самые популярные книги
+    max_fine = get_max_fine()
+    popular_books = get_top_books(3)
     
-    # Создаем PDF
+    # Создаем PDF с поддержкой кириллицы
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    
-    pdfmetrics.registerFont(TTFont('Arial', 'arial.ttf'))
-    p.setFont('Arial', 14)
+    report = PdfReport(buffer, 'Статистика библиотеки', font_size=14, line_height=30)
+    report.line(f'Максимальный штраф: {float(max_fine)} руб.')
+    report.line('Самые популярные книги:')
+    report.lines((f'- {book}: {count} выдач' for book, count in popular_books), indent=20)
+    report.save()
     
-    p.drawString(50, 800, 'Отчет по просроченным книгам')
-    p.setFont('Arial', 12)
-    
-    y = 750
-    for record in overdue_books:
-        line = f"{record.last_name} {record.first_name} - {record.name} (просрочка: {record.fine} руб.)"
-        p.drawString(50, y, line)
-        y -= 20
-    
-    p.showPage()
-    p.save()
-    
-    buffer.seek(0)
+    return buffer.getvalue()
+
+@app.route('/reports/overdue_books_pdf')
+@login_required
+@read_only
+def overdue_books_report_pdf():
+    # Список просроченных зависит и от текущей даты
+    pdf = report_cache.get_or_compute(('overdue_books_pdf', datetime.now().date()), render_overdue_books_pdf)
     return send_file(
-        buffer,
+        BytesIO(pdf),
         as_attachment=True,
         download_name='overdue_books.pdf',
         mimetype='application/pdf'
     )
 
+def render_overdue_books_pdf():
+    # Просроченные книги из снимка overdue_snapshot (flask refresh-overdue-snapshot)
+    overdue_books = overdue_snapshot_query().yield_per(app.config['PDF_ROWS_CHUNK_SIZE'])
+    built_on = overdue_snapshot_totals().built_on
+    
+    # Создаем PDF: строки таблицы читаются с сервера порциями, страницы добавляются по мере заполнения
+    buffer = BytesIO()
+    report = PdfReport(buffer, 'Отчет по просроченным книгам')
+    if built_on:
+        report.line(f'Данные на {built_on.strftime("%d.%m.%Y")}')
+    report.table(
+        [('Клиент', 160), ('Книга', 170), ('Срок возврата', 90), ('Штраф, руб.', 75)],
+        ((f'{record.client.last_name} {record.client.first_name}',
+          record.book.name,
+          record.date_end.strftime('%d.%m.%Y'),
+          record.fine) for record in overdue_books)
+    )
+    report.save()
+    
+    return buffer.getvalue()
+
 @app.cli.command("create-users")
 def create_users():
     # Создаем адмнистратора
@@ -677,15 +946,156 @@ def create_users():
     
     print('Users created successfully')
 
+@app.cli.command("import-clients")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_clients_command(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        result = import_clients(f)
+    print_import_result(result)
+
+@app.cli.command("import-books")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_books_command(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        result = import_books(f)
+    print_import_result(result)
+
+def print_import_result(result):
+    for key, value in result.as_dict().items():
+        if key != 'errors':
+            print(f'{key}: {value}')
+    for error in result.errors:
+        print(error)
+
+@app.cli.command("refresh-report-views")
+def refresh_report_views_command():
+    refresh_report_views()
+    print('Report views refreshed successfully')
+
+@app.cli.command("refresh-overdue-snapshot")
+def refresh_overdue_snapshot_command():
+    # Запускать раз в сутки после полуночи (cron): штрафы растут каждый день, появляются новые просрочки
+    built = refresh_overdue_snapshot()
+    print(f'Просроченных выдач в снимке: {built}')
+
+@app.cli.command("archive-journal")
+@click.option('--days', type=int, default=None,
+              help='Переносить возвращенные раньше стольких дней назад (по умолчанию JOURNAL_ARCHIVE_AFTER_DAYS)')
+@click.option('--batch-size', default=10000, help='Число записей в одной транзакции')
+def archive_journal_command(days, batch_size):
+    # Запускать раз в сутки: создает секции журнала на текущий и следующий год и переносит старые возвраты
+    today = datetime.now().date()
+    created = create_journal_partitions_ahead(today)
+    if days is None:
+        days = app.config['JOURNAL_ARCHIVE_AFTER_DAYS']
+    archived = archive_journal(today - timedelta(days=days), batch_size)
+    print(f'Создано секций: {created}, перенесено в архив: {archived}')
+
+@app.cli.command("reconcile-client-summary")
+def reconcile_client_summary_command():
+    changed = reconcile_client_summary()
+    print(f'Client summary reconciled, {changed} rows fixed')
+
+@app.cli.command("migrate")
+def migrate():
+    apply_migrations()
+    create_journal_partitions_ahead()
+    print('Migrations applied successfully')
+
+@app.cli.command("stress-issue")
+@click.option('--threads', default=32, help='Число параллельных потоков выдачи')
+@click.option('--issues', default=50, help='Число выдач на поток')
+@click.option('--copies', default=20, help='Число экземпляров тестовой книги')
+def stress_issue(threads, issues, copies):
+    results = run_stress(app, threads=threads, issues_per_thread=issues, copies=copies)
+    for key, value in results.items():
+        print(f'{key}: {value}')
+    if not results['ok']:
+        raise SystemExit(1)
+
+@app.cli.command("create-search-indexes")
+def create_search_indexes_command():
+    create_search_indexes()
+    print('Search indexes created successfully')
+
+@app.cli.command("check-plans")
+def check_plans_command():
+    failed = False
+    for result in check_plans():
+        if result['seq_scans']:
+            failed = True
+            print(f"{result['query']}: FAIL, Seq Scan по {', '.join(result['seq_scans'])}")
+        elif result['archive_scans']:
+            failed = True
+            print(f"{result['query']}: FAIL, читает архив {', '.join(result['archive_scans'])}")
+        else:
+            print(f"{result['query']}: ok ({', '.join(result['indexes'])})")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command("bench-seed")
+@click.option('--clients', default=1000, help='Число клиентов')
+@click.option('--books', default=500, help='Число книг')
+@click.option('--loans', default=20000, help='Число записей журнала')
+@click.option('--overdue-rate', default=0.15, help='Доля выдач с просрочкой')
+@click.option('--open-rate', default=0.05, help='Доля выдач, книги по которым еще на руках')
+@click.option('--seed', default=0, help='Начальное значение генератора случайных чисел')
+def bench_seed(clients, books, loans, overdue_rate, open_rate, seed):
+    counts = generate_library(clients=clients, books=books, loans=loans,
+                              overdue_rate=overdue_rate, open_rate=open_rate, seed=seed)
+    refresh_report_views()
+    refresh_overdue_snapshot()
+    for key, value in counts.items():
+        print(f'{key}: {value}')
+
+@app.cli.command("bench-run")
+@click.option('--route', 'routes', multiple=True, help='Маршрут для замера (по умолчанию все)')
+@click.option('--requests', default=50, help='Число запросов к каждому маршруту')
+@click.option('--concurrency', default=4, help='Число параллельных клиентов')
+@click.option('--url', default=None, help='Адрес запущенного сервера (по умолчанию тестовый клиент Flask)')
+@click.option('--username', default='admin')
+@click.option('--password', default='admin123')
+@click.option('--output', type=click.Path(dir_okay=False), help='Файл для сохранения результата (JSON)')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Предыдущий результат для сравнения')
+def bench_run(routes, requests, concurrency, url, username, password, output, compare):
+    result = run_benchmark(app, routes=list(routes), requests=requests, concurrency=concurrency,
+                           base_url=url, username=username, password=password)
+    for name, stats in result['routes'].items():
+        print(f"{name:22} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+              f"rps={stats['throughput_rps']} queries={stats['queries_avg']} errors={stats['errors']}")
+    if output:
+        save_baseline(result, output)
+    if compare:
+        for name, diff in compare_baselines(load_baseline(compare), result).items():
+            print(f'{name:22} ' + ' '.join(f'{key}={value:+}%' for key, value in diff.items()))
+
+@app.cli.command("serve-async")
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--workers', default=1, help='Число процессов')
+def serve_async(host, port, workers):
+    # Асинхронный режим: каталог API и подсказки через asyncpg, остальное - это же приложение (asgi.py)
+    import uvicorn
+    uvicorn.run('asgi:application', host=host, port=port, workers=workers)
+
 def init_db():
     with app.app_context():
         # Удаляем таблицу users если она существует
         db.session.execute(text('DROP TABLE IF EXISTS users'))
         db.session.commit()
+        user_cache.clear()
+        
+        # Расширение pg_trgm нужно для триграммных индексов поиска
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.commit()
         
         # Создаем таблицы заново
         db.create_all()
         
+        # Триггеры и прочие объекты базы из каталога migrations/
+        apply_migrations()
+        create_journal_partitions_ahead()
+        
         # Создаем пользователей с использованием метода set_password
         if User.query.count() == 0:
             admin = User(username='admin', role='admin')
@@ -711,6 +1121,8 @@ def book_type_add():
         )
         db.session.add(book_type)
         db.session.commit()
+        invalidate_book_types()
+        report_data_changed()
         flash('Тип книги успешно добавлен')
         return redirect(url_for('book_types_list'))
     return render_template('references/book_type_form.html')
@@ -724,7 +1136,12 @@ def book_type_edit(id):
         book_type.type = request.form['type']
         book_type.fine = request.form['fine']
         book_type.day_count = request.form['day_count']
+        db.session.flush()
+        # Штрафы в снимке просрочек считаются по тарифу
+        reprice_overdue_type(book_type.id)
         db.session.commit()
+        invalidate_book_types()
+        report_data_changed()
         flash('Тип книги успешно обновлен')
         return redirect(url_for('book_types_list'))
     return render_template('references/book_type_form.html', book_type=book_type)
@@ -736,27 +1153,133 @@ def book_type_delete(id):
     book_type = BookType.query.get_or_404(id)
     db.session.delete(book_type)
     db.session.commit()
+    invalidate_book_types()
+    report_data_changed()
     flash('Тип книги успешно удален')
     return redirect(url_for('book_types_list'))
 
 @app.route('/catalog')
 @login_required
+@read_only
 def catalog():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
-    query = Book.query.join(BookType)
-    
+    query = books_query()
     if search:
-        query = query.filter(
-            db.or_(
-                Book.name.ilike(f'%{search}%'),
-                BookType.type.ilike(f'%{search}%')
-            )
-        )
-    
-    pagination = query.paginate(page=page, per_page=10)
+        query = order_by_relevance(query.filter(book_search_filter(search)), search, BOOK_SEARCH_COLUMNS)
+    # Постоянный порядок страниц: при поиске - после похожести, без поиска - только по id
+    query = query.order_by(Book.id)
+    pagination = get_pagination(query, page)
     return render_template('catalog.html', books=pagination.items, pagination=pagination, search=search)
 
+# JSON API для киосков: каталог, наличие книги и книги клиента.
+# ETag и Last-Modified берутся из версии данных в базе (таблица data_version, migrations/009_data_version.sql):
+# она общая для всех процессов и серверов, поэтому повторный опрос без изменений получает 304
+# от любого из них, а после изменения данных - новый ответ. Версия читается до выполнения view,
+# один раз за запрос; сам запрос данных при 304 не выполняется.
+
+API_MAX_LIMIT = 100
+
+CATALOG_FIELDS = {
+    'id': lambda book: book.id,
+    'name': lambda book: book.name,
+    'type': lambda book: book.book_type.type if book.book_type else None,
+    'cnt': lambda book: book.cnt,
+    'available': lambda book: book.available,
+}
+
+LOAN_FIELDS = {
+    'id': lambda loan: loan.id,
+    'book_id': lambda loan: loan.book_id,
+    'book': lambda loan: loan.book.name,
+    'date_beg': lambda loan: loan.date_beg.isoformat(),
+    'date_end': lambda loan: loan.date_end.isoformat(),
+    'overdue': lambda loan: loan.is_overdue,
+    'fine': lambda loan: float(loan.fine),
+}
+
+def api_version_tag(row):
+    # Last-Modified передается с точностью до секунды
+    return f'v{row.version}-{row.today:%Y%m%d}', row.updated_at.replace(microsecond=0)
+
+def api_version():
+    return api_version_tag(data_version())
+
+def api_conditional(f):
+    # Условный GET: If-None-Match / If-Modified-Since проверяются до выполнения view
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        etag, last_modified = api_version()
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = f(*args, **kwargs)
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        # Клиент может хранить ответ, но должен проверять его при каждом запросе.
+        # Ответ зависит от пользователя (cookie сессии), как и в асинхронном режиме
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
+
+def parse_fields(value, available):
+    # ?fields=id,name - только нужные поля; без параметра - все
+    if not value:
+        return list(available)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+def api_fields(available):
+    try:
+        return parse_fields(request.args.get('fields'), available)
+    except ValueError as e:
+        abort(400, str(e))
+
+def api_limit():
+    return min(max(request.args.get('limit', 20, type=int), 1), API_MAX_LIMIT)
+
+def api_serialize(obj, fields, available):
+    return {field: available[field](obj) for field in fields}
+
+@app.route('/api/catalog')
+@login_required
+@read_only
+@api_conditional
+def api_catalog():
+    fields = api_fields(CATALOG_FIELDS)
+    limit = api_limit()
+    statement = catalog_page_statement(request.args.get('search', ''), request.args.get('after'), limit)
+    # Постраничный вывод по ключу: в ответе курсор next для следующей страницы
+    books, next_cursor = keyset_page(db.session.scalars(statement).all(), Book.id, Book.id, limit)
+    return jsonify(items=[api_serialize(book, fields, CATALOG_FIELDS) for book in books], next=next_cursor)
+
+@app.route('/api/books/<int:id>/availability')
+@login_required
+@read_only
+@api_conditional
+def api_book_availability(id):
+    book = with_availability(Book.query).filter(Book.id == id).first_or_404()
+    return jsonify(id=book.id, name=book.name, cnt=book.cnt, available=book.available)
+
+@app.route('/api/clients/<int:id>/loans')
+@login_required
+@read_only
+@api_conditional
+def api_client_loans(id):
+    fields = api_fields(LOAN_FIELDS)
+    client = clients_query().filter(Client.id == id).first_or_404()
+    loans = journal_query().filter(Journal.client_id == id, Journal.is_open).order_by(Journal.date_end)
+    return jsonify(
+        client_id=client.id,
+        open_loans=client.summary.open_loans if client.summary else 0,
+        fines=float(client.summary.fines) if client.summary else 0,
+        loans=[api_serialize(loan, fields, LOAN_FIELDS) for loan in loans]
+    )
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -0,0 +1,192 @@
+import re
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.http import is_resource_modified, http_date
+from app import (app, config, user_cache, api_version_tag, parse_fields, api_serialize,
+                 CATALOG_FIELDS, API_MAX_LIMIT)
+from models import User, Book, BookType
+from queries import with_availability, data_version_statement
+from search import (LOOKUP_LIMIT, LOOKUP_MAX_LIMIT, catalog_page_statement, client_lookup_statement,
+                    book_lookup_statement, client_label, book_label)
+from references import book_type_cache, book_type_infos
+from pagination import keyset_page
+from routing import REPLICA_BIND
+
+# Асинхронный режим (uvicorn asgi:application, или flask serve-async): частые маршруты только для чтения
+# (каталог и наличие книг в API, подсказки формы выдачи) выполняются в цикле событий через asyncpg,
+# и ожидание базы не занимает поток. Остальные маршруты и все изменения данных идут в то же
+# Flask-приложение через WsgiToAsgi. Модели и сами запросы общие с синхронным режимом.
+# Если асинхронный обработчик не может ответить сам (нет входа, 404, неверные параметры),
+# запрос передается во Flask - ответ получается тот же, что в синхронном режиме.
+
+wsgi_application = WsgiToAsgi(app)
+
+_engine = None
+_sessionmaker = None
+
+def async_database_url():
+    # Чтение идет на реплику, если она настроена
+    url = app.config.get('SQLALCHEMY_BINDS', {}).get(REPLICA_BIND, app.config['SQLALCHEMY_DATABASE_URI'])
+    return make_url(url).set(drivername='postgresql+asyncpg')
+
+def get_sessionmaker():
+    global _engine, _sessionmaker
+    if _sessionmaker is None:
+        options = {key: value for key, value in app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()
+                   if key != 'connect_args'}
+        # asyncpg не понимает параметр options, ограничение времени запроса передаем через server_settings
+        options['connect_args'] = {'server_settings': {
+            'statement_timeout': str(config.getint('pool', 'statement_timeout', fallback=30000))
+        }}
+        _engine = create_async_engine(async_database_url(), **options)
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _sessionmaker
+
+class AsyncRequest:
+    def __init__(self, scope):
+        self.scope = scope
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+
+    def get_int(self, key, default):
+        try:
+            return int(self.args[key])
+        except (KeyError, ValueError):
+            return default
+
+    def cookie(self, name):
+        for part in self.headers.get('cookie', '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == name:
+                return value.strip('"')
+        return None
+
+    def environ(self):
+        # Минимальный WSGI environ для проверок условного GET из werkzeug
+        return {'HTTP_' + key.upper().replace('-', '_'): value for key, value in self.headers.items()}
+
+async def current_user_id(request, session):
+    # Тот же вход, что у Flask-Login: id пользователя в подписанной cookie сессии Flask
+    cookie = request.cookie(app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    user_id = data.get('_user_id')
+    if user_id is None:
+        return None
+    if user_cache.get(user_id) is None:
+        user = await session.get(User, int(user_id))
+        if user is None:
+            return None
+        user_cache.set(user_id, {
+            'id': user.id,
+            'username': user.username,
+            'password_hash': user.password_hash,
+            'role': user.role
+        })
+    return user_id
+
+async def book_types(session):
+    result = book_type_cache.get('all')
+    if result is None:
+        result = book_type_infos(await session.scalars(select(BookType).order_by(BookType.id)))
+        book_type_cache.set('all', result)
+    return result
+
+async def api_catalog(request, session):
+    try:
+        fields = parse_fields(request.args.get('fields'), CATALOG_FIELDS)
+    except ValueError:
+        return None
+    limit = min(max(request.get_int('limit', 20), 1), API_MAX_LIMIT)
+    statement = catalog_page_statement(request.args.get('search', ''), request.args.get('after'), limit)
+    books, next_cursor = keyset_page((await session.scalars(statement)).all(), Book.id, Book.id, limit)
+    return {'items': [api_serialize(book, fields, CATALOG_FIELDS) for book in books], 'next': next_cursor}
+
+async def api_book_availability(request, session, id):
+    book = (await session.scalars(with_availability(select(Book)).where(Book.id == id))).first()
+    if book is None:
+        return None
+    return {'id': book.id, 'name': book.name, 'cnt': book.cnt, 'available': book.available}
+
+def lookup_limit(request):
+    return min(max(request.get_int('limit', LOOKUP_LIMIT), 1), LOOKUP_MAX_LIMIT)
+
+async def lookup_clients(request, session):
+    statement = client_lookup_statement(request.args.get('q', ''), lookup_limit(request))
+    clients = (await session.scalars(statement)).all() if statement is not None else []
+    return [{'id': client.id, 'label': client_label(client)} for client in clients]
+
+async def lookup_books(request, session):
+    statement = book_lookup_statement(request.args.get('q', ''), lookup_limit(request))
+    books = (await session.scalars(statement)).all() if statement is not None else []
+    types = await book_types(session)
+    return [{'id': book.id, 'label': book_label(book, types.get(book.type_id))} for book in books]
+
+# Путь, обработчик и нужен ли условный GET (ETag/Last-Modified, как api_conditional)
+ROUTES = [
+    (re.compile(r'/api/catalog'), api_catalog, True),
+    (re.compile(r'/api/books/(?P<id>\d+)/availability'), api_book_availability, True),
+    (re.compile(r'/lookup/clients'), lookup_clients, False),
+    (re.compile(r'/lookup/books'), lookup_books, False),
+]
+
+def match_route(scope):
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None, None, None
+    for pattern, handler, conditional in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match:
+            return handler, conditional, {key: int(value) for key, value in match.groupdict().items()}
+    return None, None, None
+
+async def send_response(send, status, headers, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _engine is not None:
+                await _engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    handler, conditional, kwargs = match_route(scope)
+    if handler is None:
+        return await wsgi_application(scope, receive, send)
+    request = AsyncRequest(scope)
+    async with get_sessionmaker()() as session:
+        if await current_user_id(request, session) is None:
+            return await wsgi_application(scope, receive, send)
+        headers = [('Vary', 'Cookie')]
+        if conditional:
+            etag, last_modified = api_version_tag((await session.execute(data_version_statement())).one())
+            headers += [('ETag', f'W/"{etag}"'), ('Last-Modified', http_date(last_modified)),
+                        ('Cache-Control', 'no-cache')]
+            if not is_resource_modified(request.environ(), etag=etag, last_modified=last_modified):
+                return await send_response(send, 304, headers)
+        data = await handler(request, session, **kwargs)
+    if data is None:
+        return await wsgi_application(scope, receive, send)
+    # Тот же JSON, что у jsonify в синхронном режиме
+    response = app.json.response(data)
+    body = response.get_data()
+    headers += [('Content-Type', response.content_type), ('Content-Length', str(len(body)))]
+    await send_response(send, 200, headers, body)
@@ -0,0 +1,331 @@
+import json
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import date, datetime, timedelta
+from flask import g, request_finished
+from sqlalchemy import insert, select, func
+from models import db, Client, BookType, Book, Journal
+from issuing import MAX_CLIENT_BOOKS
+
+# Нагрузочные замеры: генератор синтетической библиотеки заданного размера и прогон маршрутов
+# через тестовый клиент Flask (или по HTTP на запущенный сервер) в несколько потоков.
+# Для каждого маршрута считаются перцентили времени ответа, пропускная способность и число
+# SQL-запросов; результат сохраняется в JSON и сравнивается с предыдущим прогоном.
+
+INSERT_CHUNK_SIZE = 5000
+
+# Категории книг из ТЗ: название, штраф за день, срок выдачи и доля в фонде
+DEFAULT_BOOK_TYPES = [('обычная', 10, 60, 0.8), ('редкая', 50, 21, 0.15), ('уникальная', 300, 7, 0.05)]
+
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов']
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Артем', 'Илья',
+               'Кирилл', 'Михаил', 'Никита', 'Матвей', 'Роман', 'Егор', 'Арсений', 'Иван']
+FATHER_NAMES = ['Александрович', 'Дмитриевич', 'Сергеевич', 'Андреевич', 'Алексеевич', 'Иванович',
+                'Михайлович', 'Николаевич', 'Петрович', 'Викторович']
+TITLE_WORDS = ['Война', 'мир', 'Преступление', 'наказание', 'Отцы', 'дети', 'Мертвые', 'души',
+               'Герой', 'нашего', 'времени', 'Тихий', 'Дон', 'Белая', 'гвардия', 'Вишневый', 'сад']
+
+def _insert_ids(model, rows):
+    ids = []
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        ids += db.session.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows[start:start + INSERT_CHUNK_SIZE]
+        ).scalars().all()
+    return ids
+
+def _book_types():
+    book_types = BookType.query.all()
+    if not book_types:
+        book_types = [BookType(type=name, fine=fine, day_count=days)
+                      for name, fine, days, _ in DEFAULT_BOOK_TYPES]
+        db.session.add_all(book_types)
+        db.session.flush()
+    weights = {name: share for name, _, _, share in DEFAULT_BOOK_TYPES}
+    return book_types, [weights.get(book_type.type, 0.1) for book_type in book_types]
+
+def _loan(rnd, today, day_count, is_open, is_overdue, history_days):
+    if is_open:
+        if is_overdue:
+            date_beg = today - timedelta(days=day_count + rnd.randint(1, 30))
+        else:
+            date_beg = today - timedelta(days=rnd.randint(0, day_count - 1))
+        return date_beg, date_beg + timedelta(days=day_count), None
+    # Возвращенные книги выданы достаточно давно, чтобы дата возврата не попала в будущее
+    date_beg = today - timedelta(days=day_count + 31 + rnd.randint(0, history_days))
+    date_end = date_beg + timedelta(days=day_count)
+    if is_overdue:
+        date_ret = date_end + timedelta(days=rnd.randint(1, 30))
+    else:
+        date_ret = date_beg + timedelta(days=rnd.randint(0, day_count))
+    return date_beg, date_end, date_ret
+
+def generate_library(clients=1000, books=500, loans=20000, overdue_rate=0.15, open_rate=0.05,
+                     history_days=730, seed=0):
+    # Заполняет базу синтетическими данными пакетными INSERT.
+    # overdue_rate - доля выдач с просрочкой (и среди возвращенных, и среди книг на руках),
+    # open_rate - доля выдач, которые еще не возвращены (с учетом лимитов клиента и числа экземпляров).
+    rnd = random.Random(seed)
+    today = date.today()
+    book_types, weights = _book_types()
+
+    client_ids = _insert_ids(Client, [{
+        'last_name': rnd.choice(LAST_NAMES),
+        'first_name': rnd.choice(FIRST_NAMES),
+        'father_name': rnd.choice(FATHER_NAMES),
+        'passport_seria': f'{rnd.randint(1000, 9999)}',
+        'passport_number': f'{i % 1000000:06d}',
+    } for i in range(clients)])
+
+    book_rows = []
+    for i in range(books):
+        book_type = rnd.choices(book_types, weights)[0]
+        book_rows.append({
+            'name': f'{" ".join(rnd.sample(TITLE_WORDS, 3))} {i + 1}'.capitalize(),
+            'cnt': rnd.randint(1, 10),
+            'type_id': book_type.id,
+        })
+    book_ids = _insert_ids(Book, book_rows)
+    day_counts = {book_type.id: book_type.day_count for book_type in book_types}
+    books_info = [(book_id, row['cnt'], day_counts[row['type_id']]) for book_id, row in zip(book_ids, book_rows)]
+
+    client_open = Counter()
+    book_open = Counter()
+    chunk = []
+    opened = 0
+    for _ in range(loans):
+        client_id = rnd.choice(client_ids)
+        book_id, cnt, day_count = rnd.choice(books_info)
+        is_open = (rnd.random() < open_rate and client_open[client_id] < MAX_CLIENT_BOOKS
+                   and book_open[book_id] < cnt)
+        if is_open:
+            client_open[client_id] += 1
+            book_open[book_id] += 1
+            opened += 1
+        date_beg, date_end, date_ret = _loan(rnd, today, day_count, is_open,
+                                             rnd.random() < overdue_rate, history_days)
+        chunk.append({'client_id': client_id, 'book_id': book_id,
+                      'date_beg': date_beg, 'date_end': date_end, 'date_ret': date_ret})
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            db.session.execute(insert(Journal), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(Journal), chunk)
+    db.session.commit()
+
+    return {'clients': len(client_ids), 'books': len(book_ids), 'loans': loans, 'open_loans': opened}
+
+
+# Прогон маршрутов
+
+_local = threading.local()
+
+def _remember_query_count(sender, response, **extra):
+    # Число запросов считает queries._count_query, здесь забираем его до конца запроса
+    _local.query_count = g.get('query_count', 0)
+
+def route_specs(client_ids, book_ids):
+    # Маршрут -> функция, возвращающая (метод, путь, данные формы) для очередного запроса
+    today = date.today().isoformat()
+    return {
+        'journal_list': lambda rnd: ('GET', f'/journal?page={rnd.randint(1, 20)}', None),
+        'journal_list_search': lambda rnd: ('GET', f'/journal?search={rnd.choice(LAST_NAMES)}', None),
+        'journal_add_form': lambda rnd: ('GET', '/journal/add', None),
+        'journal_add': lambda rnd: ('POST', '/journal/add', {
+            'client_id': rnd.choice(client_ids), 'book_id': rnd.choice(book_ids), 'date_beg': today}),
+        'clients_list': lambda rnd: ('GET', f'/references/clients?page={rnd.randint(1, 20)}', None),
+        'books_list': lambda rnd: ('GET', f'/books?page={rnd.randint(1, 20)}', None),
+        'catalog': lambda rnd: ('GET', f'/catalog?search={rnd.choice(TITLE_WORDS)}', None),
+        'library_stats': lambda rnd: ('GET', '/reports/library_stats', None),
+        'library_stats_pdf': lambda rnd: ('GET', '/reports/library_stats_pdf', None),
+        'overdue_books_pdf': lambda rnd: ('GET', '/reports/overdue_books_pdf', None),
+        'client_books_pdf': lambda rnd: ('GET', f'/reports/client_books_pdf/{rnd.choice(client_ids)}', None),
+        # Маршруты асинхронного режима (asgi.py): для сравнения запускается bench-run --url
+        # сначала против обычного сервера, затем против serve-async с --compare
+        'api_catalog': lambda rnd: ('GET', f'/api/catalog?search={rnd.choice(TITLE_WORDS)}', None),
+        'api_book_availability': lambda rnd: ('GET', f'/api/books/{rnd.choice(book_ids)}/availability', None),
+        'lookup_clients': lambda rnd: ('GET', f'/lookup/clients?q={rnd.choice(LAST_NAMES)[:3]}', None),
+        'lookup_books': lambda rnd: ('GET', f'/lookup/books?q={rnd.choice(TITLE_WORDS)[:3]}', None),
+    }
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data else None
+        # Поиск по русским словам: в адресе допустимы только ASCII-символы
+        url = self.base_url + urllib.parse.quote(path, safe='/?=&')
+        req = urllib.request.Request(url, data=body, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, None
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        _local.query_count = None
+        response = self.client.open(path, method=method, data=data)
+        # Потоковые ответы (экспорт CSV) нужно дочитать, иначе время запроса будет неполным
+        response.get_data()
+        return response.status_code, _local.query_count
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+def _summary(samples, elapsed):
+    latencies = [ms for ms, _, _ in samples]
+    queries = [count for _, _, count in samples if count is not None]
+    statuses = Counter(status for _, status, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(n for status, n in statuses.items() if status >= 400),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else None,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'queries_avg': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+def run_benchmark(app, routes=None, requests=50, concurrency=4, base_url=None,
+                  username='admin', password='admin123', seed=0):
+    with app.app_context():
+        client_ids = db.session.execute(select(Client.id).order_by(Client.id).limit(1000)).scalars().all()
+        book_ids = db.session.execute(select(Book.id).order_by(Book.id).limit(1000)).scalars().all()
+        data = {
+            'clients': db.session.query(func.count(Client.id)).scalar(),
+            'books': db.session.query(func.count(Book.id)).scalar(),
+            'loans': db.session.query(func.count(Journal.id)).scalar(),
+        }
+        dialect = db.engine.dialect.name
+        db.session.remove()
+    if not client_ids or not book_ids:
+        raise ValueError('В базе нет клиентов или книг, сначала выполните bench-seed')
+
+    specs = route_specs(client_ids, book_ids)
+    names = routes or list(specs)
+    unknown = [name for name in names if name not in specs]
+    if unknown:
+        raise ValueError(f'Неизвестные маршруты: {", ".join(unknown)}')
+
+    tasks = queue.Queue()
+    order = [name for name in names for _ in range(requests)]
+    random.Random(seed).shuffle(order)
+    for name in order:
+        tasks.put(name)
+
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    errors = []
+
+    def make_client():
+        client = HttpClient(base_url) if base_url else TestClient(app)
+        status, _ = client.request('POST', '/login', {'username': username, 'password': password})
+        if status != 302:
+            raise RuntimeError(f'Не удалось войти как {username} (код ответа {status})')
+        return client
+
+    def worker(n):
+        rnd = random.Random(seed + n)
+        try:
+            client = make_client()
+            # Прогрев: первый запрос к каждому маршруту не учитываем
+            for name in names:
+                client.request(*specs[name](rnd))
+            ready.wait()
+            while True:
+                try:
+                    name = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                t0 = time.perf_counter()
+                status, query_count = client.request(*specs[name](rnd))
+                ms = round((time.perf_counter() - t0) * 1000, 2)
+                with lock:
+                    samples[name].append((ms, status, query_count))
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            errors.append(e)
+            ready.abort()
+
+    # Замер начинается, когда все потоки вошли в систему и прогрелись
+    ready = threading.Barrier(concurrency + 1)
+    request_finished.connect(_remember_query_count, app)
+    try:
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+        for t in workers:
+            t.start()
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            pass
+        t0 = time.perf_counter()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        request_finished.disconnect(_remember_query_count, app)
+    if errors:
+        raise errors[0]
+
+    all_samples = [sample for values in samples.values() for sample in values]
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'mode': 'http' if base_url else 'test-client',
+            'database': dialect,
+            'concurrency': concurrency,
+            'requests_per_route': requests,
+            'seconds': round(elapsed, 3),
+            'data': data,
+        },
+        'routes': {name: _summary(values, elapsed) for name, values in samples.items()},
+        'total': _summary(all_samples, elapsed),
+    }
+
+def save_baseline(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare_baselines(old, new, keys=('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_avg')):
+    # Изменение показателей нового прогона относительно старого, в процентах
+    diff = {}
+    for name, current in new['routes'].items():
+        previous = old['routes'].get(name)
+        if previous is None:
+            continue
+        diff[name] = {}
+        for key in keys:
+            before, after = previous.get(key), current.get(key)
+            if before and after is not None:
+                diff[name][key] = round((after - before) / before * 100, 1)
+    return diff
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # Кэш в памяти процесса с ограничением размера (вытесняются давно не использованные записи)
+    # и временем жизни записей. Размер и время жизни задаются в конфигурации: <prefix>_SIZE, <prefix>_TTL.
+
+    def __init__(self, app=None, prefix='CACHE', max_size=128, ttl=300):
+        self.prefix = prefix
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.setdefault(f'{self.prefix}_SIZE', self.max_size)
+        self.ttl = app.config.setdefault(f'{self.prefix}_TTL', self.ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class ResultCache(TTLCache):
+    # Кэш вычисленных результатов (готовые файлы отчетов).
+    # Ключ включает версию данных, которую возвращает get_version (строка data_version в базе,
+    # общая для всех процессов): после изменения данных в любом процессе старые записи больше
+    # не находятся и вытесняются по мере заполнения кэша.
+
+    def __init__(self, app=None, prefix='REPORT_CACHE', max_size=64, ttl=600, get_version=None):
+        self.get_version = get_version
+        super().__init__(app, prefix=prefix, max_size=max_size, ttl=ttl)
+
+    @property
+    def version(self):
+        return self.get_version()
+
+    def get_or_compute(self, key, compute):
+        full_key = (key, self.version)
+        value = self.get(full_key)
+        if value is None:
+            value = compute()
+            self.set(full_key, value)
+        return value
@@ -0,0 +1,74 @@
+import json
+from sqlalchemy import select, func, text
+from sqlalchemy.orm import undefer
+from models import db, Client, Book, Journal, OverdueSnapshot
+from search import (journal_search_filter, book_search_filter, client_lookup_statement,
+                    book_lookup_statement)
+
+# Проверка планов частых запросов: каждый запрос выполняется через EXPLAIN с выключенным
+# последовательным сканированием (enable_seqscan = off). Если в плане все равно остается Seq Scan
+# по таблице, значит подходящего индекса нет (см. migrations/003_hot_query_indexes.sql,
+# 011_lookup_order_indexes.sql). Запросы по книгам на руках не должны читать архивные секции журнала
+# (migrations/007_journal_partitions.sql).
+
+ARCHIVE_PARTITION_PREFIX = 'journal_archive'
+OPEN_LOAN_QUERIES = {'open_loans_by_client', 'open_loans_by_book', 'book_available', 'overdue_loans'}
+
+def hot_queries():
+    return [
+        ('open_loans_by_client', select(func.count(Journal.id)).where(
+            Journal.client_id == 1, Journal.is_open)),
+        ('open_loans_by_book', select(func.count(Journal.id)).where(
+            Journal.book_id == 1, Journal.is_open)),
+        ('book_available', select(Book).options(undefer(Book.available)).where(Book.id == 1)),
+        ('overdue_loans', select(Journal.id).where(Journal.is_overdue)),
+        ('client_history', select(Journal.id).where(Journal.client_id == 1)),
+        ('book_name_duplicate', select(Book.id).where(func.lower(Book.name) == 'война и мир')),
+        ('clients_by_last_name', select(Client.id).order_by(Client.last_name).limit(10)),
+        ('client_lookup', client_lookup_statement('ив')),
+        ('client_passport_lookup', client_lookup_statement('4010')),
+        ('book_lookup', book_lookup_statement('война')),
+        ('journal_search', select(Journal.id).where(journal_search_filter('иван'))),
+        ('catalog_search', select(Book.id).where(book_search_filter('война'))),
+        ('overdue_snapshot_top', select(OverdueSnapshot.journal_id).order_by(
+            OverdueSnapshot.fine.desc(), OverdueSnapshot.journal_id).limit(10)),
+    ]
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _nodes(child)
+
+def _seq_scans(plan):
+    # Таблицы, которые в плане читаются последовательным сканированием
+    return [node.get('Relation Name') for node in _nodes(plan) if node.get('Node Type') == 'Seq Scan']
+
+def _archive_scans(plan):
+    return [node['Relation Name'] for node in _nodes(plan)
+            if node.get('Relation Name', '').startswith(ARCHIVE_PARTITION_PREFIX)]
+
+def _indexes(plan):
+    return [node['Index Name'] for node in _nodes(plan) if 'Index Name' in node]
+
+def explain(statement):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+def check_plans():
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Проверка планов запросов работает только с PostgreSQL')
+    results = []
+    try:
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        for name, statement in hot_queries():
+            plan = explain(statement)
+            results.append({'query': name, 'seq_scans': _seq_scans(plan), 'indexes': _indexes(plan),
+                            'archive_scans': _archive_scans(plan) if name in OPEN_LOAN_QUERIES else []})
+    finally:
+        db.session.rollback()
+    return results
@@ -0,0 +1,158 @@
+import csv
+from io import StringIO
+from sqlalchemy import MetaData, Table, Column, Integer, String, select, insert, func, and_
+from models import db, Client, BookType, Book
+from validators import validate_client, validate_book
+from references import get_book_types
+
+# Массовая загрузка клиентов и книг из CSV.
+# Файл читается построчно, корректные строки пачками по CHUNK_SIZE копируются (COPY) во временную
+# таблицу, откуда одним INSERT ... SELECT переносятся в основную таблицу без дубликатов.
+# В памяти держится не больше одной пачки, независимо от размера файла.
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 20
+
+CLIENT_COLUMNS = ['last_name', 'first_name', 'father_name', 'passport_seria', 'passport_number']
+BOOK_COLUMNS = ['name', 'cnt', 'type']
+
+_metadata = MetaData()
+
+clients_staging = Table(
+    'import_clients', _metadata,
+    Column('line', Integer, nullable=False),
+    Column('last_name', String(50)),
+    Column('first_name', String(50)),
+    Column('father_name', String(50)),
+    Column('passport_seria', String(4)),
+    Column('passport_number', String(6)),
+    prefixes=['TEMPORARY']
+)
+
+books_staging = Table(
+    'import_books', _metadata,
+    Column('line', Integer, nullable=False),
+    Column('name', String(100)),
+    Column('cnt', Integer),
+    Column('type', String(20)),
+    prefixes=['TEMPORARY']
+)
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.errors = []
+
+    @property
+    def duplicates(self):
+        return self.rows - self.invalid - self.inserted
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'Строка {line}: {message}')
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'errors': self.errors,
+        }
+
+def _copy_rows(connection, table, rows):
+    if connection.dialect.name == 'postgresql':
+        buffer = StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f'COPY {table.name} ({", ".join(c.name for c in table.columns)}) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+        cursor.close()
+    else:
+        keys = [c.name for c in table.columns]
+        connection.execute(insert(table), [dict(zip(keys, row)) for row in rows])
+
+def _load(stream, table, columns, validate, insert_new):
+    result = ImportResult()
+    connection = db.session.connection()
+    table.create(connection)
+    try:
+        reader = csv.DictReader(stream)
+        missing = [c for c in columns if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f'В файле нет колонок: {", ".join(missing)}')
+
+        chunk = []
+        for line, record in enumerate(reader, start=2):
+            result.rows += 1
+            values = [(record.get(c) or '').strip() for c in columns]
+            error = validate(*values)
+            if error:
+                result.add_error(line, error)
+                continue
+            chunk.append([line] + values)
+            if len(chunk) >= CHUNK_SIZE:
+                _copy_rows(connection, table, chunk)
+                result.inserted += insert_new(connection)
+                chunk = []
+        if chunk:
+            _copy_rows(connection, table, chunk)
+            result.inserted += insert_new(connection)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        table.drop(db.session.connection(), checkfirst=True)
+        db.session.commit()
+    return result
+
+def _insert_new_clients(connection):
+    s = clients_staging
+    # Из файла берем первую строку для каждого паспорта, которого еще нет в базе
+    first_lines = select(func.min(s.c.line)).group_by(s.c.passport_seria, s.c.passport_number)
+    exists = select(Client.id).where(
+        Client.passport_seria == s.c.passport_seria,
+        Client.passport_number == s.c.passport_number
+    ).exists()
+    rows = select(*[s.c[c] for c in CLIENT_COLUMNS]).where(s.c.line.in_(first_lines), ~exists)
+    inserted = connection.execute(insert(Client.__table__).from_select(CLIENT_COLUMNS, rows)).rowcount
+    connection.execute(s.delete())
+    return inserted
+
+def _insert_new_books(connection):
+    s = books_staging
+    # Книга с таким названием (без учета регистра) уже есть - пропускаем, как в books_add
+    first_lines = select(func.min(s.c.line)).group_by(func.lower(s.c.name))
+    exists = select(Book.id).where(func.lower(Book.name) == func.lower(s.c.name)).exists()
+    rows = select(s.c.name, s.c.cnt, BookType.id).join(
+        BookType.__table__, func.lower(BookType.type) == func.lower(s.c.type)
+    ).where(and_(s.c.line.in_(first_lines), ~exists))
+    inserted = connection.execute(
+        insert(Book.__table__).from_select(['name', 'cnt', 'type_id'], rows)
+    ).rowcount
+    connection.execute(s.delete())
+    return inserted
+
+def import_clients(stream):
+    return _load(stream, clients_staging, CLIENT_COLUMNS, validate_client, _insert_new_clients)
+
+def import_books(stream):
+    book_types = {book_type.type.lower() for book_type in get_book_types().values() if book_type.type}
+
+    def validate(name, cnt, type):
+        error = validate_book(name, cnt)
+        if error:
+            return error
+        if type.lower() not in book_types:
+            return f'Неизвестный тип книги: {type}'
+        return None
+
+    return _load(stream, books_staging, BOOK_COLUMNS, validate, _insert_new_books)
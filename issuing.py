@@ -0,0 +1,265 @@
+import time
+import threading
+from datetime import date, timedelta
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import OperationalError, IntegrityError
+from models import db, Client, ClientSummary, Book, Journal
+from references import get_book_type
+from reports import discard_overdue
+
+# Выдача книги одной транзакцией: строки клиента и книги блокируются (SELECT ... FOR UPDATE),
+# поэтому проверка лимитов и вставка в журнал не пересекаются с параллельными выдачами.
+# Те же правила дублирует триггер journal_check_issue (migrations/001_journal_issue_trigger.sql).
+
+MAX_CLIENT_BOOKS = 10
+MAX_RETRIES = 3
+
+# Коды ошибок PostgreSQL, при которых транзакцию можно повторить
+RETRYABLE_PGCODES = {'40001', '40P01'}  # serialization_failure, deadlock_detected
+
+class IssueError(Exception):
+    pass
+
+def _pgcode(error):
+    return getattr(error.orig, 'pgcode', None)
+
+def lock_client(client_id):
+    # FOR NO KEY UPDATE: не мешает проверке внешнего ключа при обновлении сводки по клиенту
+    client = Client.query.filter_by(id=client_id).with_for_update(key_share=True).first()
+    if client is None:
+        raise IssueError('Клиент не найден')
+    return client
+
+def lock_book(book_id):
+    book = Book.query.filter_by(id=book_id).with_for_update().first()
+    if book is None:
+        raise IssueError('Книга не найдена')
+    return book
+
+def open_loans_count(client_id):
+    # Счетчик из сводки по клиенту, обновляется триггером в той же транзакции, что и журнал
+    return db.session.query(ClientSummary.open_loans).filter_by(client_id=client_id).scalar() or 0
+
+def issued_count(book_id):
+    return Journal.query.filter(Journal.book_id == book_id, Journal.is_open).count()
+
+def _issue(client_id, book_id, date_beg):
+    # Блокируем всегда в одном порядке (клиент, затем книга), чтобы не было взаимных блокировок
+    lock_client(client_id)
+    book = lock_book(book_id)
+
+    if open_loans_count(client_id) >= MAX_CLIENT_BOOKS:
+        raise IssueError('Клиент не может взять больше 10 книг')
+
+    if issued_count(book_id) >= book.cnt:
+        raise IssueError('Книга недоступна для выдачи (все экземпляры на руках)')
+
+    book_type = get_book_type(book.type_id)
+    if book_type is None:
+        raise IssueError('У книги не указан тип')
+
+    journal = Journal(
+        client_id=client_id,
+        book_id=book_id,
+        date_beg=date_beg,
+        date_end=date_beg + timedelta(days=book_type.day_count)
+    )
+    db.session.add(journal)
+    db.session.flush()
+    return journal
+
+def issue_book(client_id, book_id, date_beg, retries=MAX_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            journal = _issue(client_id, book_id, date_beg)
+            db.session.commit()
+            return journal
+        except IssueError:
+            db.session.rollback()
+            raise
+        except IntegrityError as e:
+            # Отказ триггера (check_violation) или нарушение внешнего ключа
+            db.session.rollback()
+            raise IssueError(str(e.orig).splitlines()[0]) from e
+        except OperationalError as e:
+            db.session.rollback()
+            if _pgcode(e) not in RETRYABLE_PGCODES or attempt == retries:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+
+def _issue_many(items, date_beg):
+    # Блокируем всех клиентов, затем все книги, в порядке возрастания id (как и при одиночной выдаче)
+    client_ids = sorted({client_id for client_id, _ in items})
+    book_ids = sorted({book_id for _, book_id in items})
+    clients = {client.id for client in
+               Client.query.filter(Client.id.in_(client_ids)).order_by(Client.id).with_for_update(key_share=True)}
+    books = {book.id: book for book in
+             Book.query.filter(Book.id.in_(book_ids)).order_by(Book.id).with_for_update()}
+
+    # Текущее число книг на руках у каждого клиента (из сводки) и выданных экземпляров каждой книги
+    client_loans = dict(db.session.query(ClientSummary.client_id, ClientSummary.open_loans).filter(
+        ClientSummary.client_id.in_(client_ids)
+    ).all())
+    book_issued = dict(db.session.query(Journal.book_id, func.count(Journal.id)).filter(
+        Journal.book_id.in_(book_ids),
+        Journal.is_open
+    ).group_by(Journal.book_id).all())
+
+    results = []
+    rows = []
+    for client_id, book_id in items:
+        result = {'client_id': client_id, 'book_id': book_id, 'ok': False}
+        results.append(result)
+        book = books.get(book_id)
+        if client_id not in clients:
+            result['error'] = 'Клиент не найден'
+        elif book is None:
+            result['error'] = 'Книга не найдена'
+        elif client_loans.get(client_id, 0) >= MAX_CLIENT_BOOKS:
+            result['error'] = 'Клиент не может взять больше 10 книг'
+        elif book_issued.get(book_id, 0) >= book.cnt:
+            result['error'] = 'Книга недоступна для выдачи (все экземпляры на руках)'
+        elif get_book_type(book.type_id) is None:
+            result['error'] = 'У книги не указан тип'
+        else:
+            client_loans[client_id] = client_loans.get(client_id, 0) + 1
+            book_issued[book_id] = book_issued.get(book_id, 0) + 1
+            result['ok'] = True
+            rows.append({
+                'client_id': client_id,
+                'book_id': book_id,
+                'date_beg': date_beg,
+                'date_end': date_beg + timedelta(days=get_book_type(book.type_id).day_count)
+            })
+
+    if rows:
+        journal_ids = db.session.execute(
+            insert(Journal).returning(Journal.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for result, journal_id in zip([r for r in results if r['ok']], journal_ids):
+            result['journal_id'] = journal_id
+    return results
+
+def _issue_one(client_id, book_id, date_beg):
+    result = {'client_id': client_id, 'book_id': book_id, 'ok': False}
+    try:
+        result['journal_id'] = issue_book(client_id, book_id, date_beg).id
+        result['ok'] = True
+    except IssueError as e:
+        result['error'] = str(e)
+    return result
+
+def issue_books(items, date_beg, retries=MAX_RETRIES):
+    # Пакетная выдача: список пар (client_id, book_id) одной транзакцией и одним INSERT
+    for attempt in range(retries + 1):
+        try:
+            results = _issue_many(items, date_beg)
+            db.session.commit()
+            return results
+        except IntegrityError:
+            # Триггер отклонил одну из выдач (например, сводка по клиенту разошлась с журналом)
+            # или клиент либо книга удалены параллельно. Выдаем по одной, чтобы ошибка
+            # досталась своей позиции, а остальные книги были выданы
+            db.session.rollback()
+            return [_issue_one(client_id, book_id, date_beg) for client_id, book_id in items]
+        except OperationalError as e:
+            db.session.rollback()
+            if _pgcode(e) not in RETRYABLE_PGCODES or attempt == retries:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+
+def return_books(journal_ids, date_ret):
+    # Пакетный возврат одним UPDATE; уже возвращенные и несуществующие записи не меняются
+    returned = set(db.session.execute(
+        update(Journal)
+        .where(Journal.id.in_(journal_ids), Journal.is_open)
+        .values(date_ret=date_ret)
+        .returning(Journal.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    if returned:
+        discard_overdue(returned)
+    db.session.commit()
+
+    results = []
+    for journal_id in journal_ids:
+        result = {'journal_id': journal_id, 'ok': journal_id in returned}
+        if not result['ok']:
+            result['error'] = 'Запись не найдена или книга уже возвращена'
+        results.append(result)
+    return results
+
+def run_stress(app, threads=32, issues_per_thread=50, copies=20, clients_count=40):
+    # Нагрузочная проверка: много потоков одновременно выдают одну и ту же книгу разным клиентам.
+    # После прогона на руках не должно быть больше copies экземпляров и больше 10 книг у клиента.
+    with app.app_context():
+        book_type_id = db.session.query(Book.type_id).filter(Book.type_id.isnot(None)).limit(1).scalar()
+        book = Book(name='Нагрузочный тест', cnt=copies, type_id=book_type_id)
+        clients = [Client(last_name='Тестов', first_name='Тест', father_name='',
+                          passport_seria='0000', passport_number=f'{i:06d}')
+                   for i in range(clients_count)]
+        db.session.add(book)
+        db.session.add_all(clients)
+        db.session.commit()
+        book_id = book.id
+        client_ids = [client.id for client in clients]
+
+    results = {'issued': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker(n):
+        with app.app_context():
+            for i in range(issues_per_thread):
+                client_id = client_ids[(n * issues_per_thread + i) % len(client_ids)]
+                try:
+                    issue_book(client_id, book_id, date.today())
+                    key = 'issued'
+                except IssueError:
+                    key = 'rejected'
+                except Exception:
+                    db.session.rollback()
+                    key = 'errors'
+                with lock:
+                    results[key] += 1
+
+                # Часть выданных книг сразу возвращаем, чтобы экземпляры освобождались
+                if key == 'issued' and i % 3 == 0:
+                    loan = Journal.query.filter(Journal.client_id == client_id, Journal.book_id == book_id,
+                                                Journal.is_open).with_for_update().first()
+                    if loan:
+                        loan.date_ret = date.today()
+                    db.session.commit()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        on_hand = issued_count(book_id)
+        max_client_books = max(open_loans_count(client_id) for client_id in client_ids)
+        # Счетчики в сводке должны совпадать с журналом и после параллельных выдач
+        summary_mismatches = sum(
+            open_loans_count(client_id) != Journal.query.filter(Journal.client_id == client_id, Journal.is_open).count()
+            for client_id in client_ids
+        )
+        Journal.query.filter_by(book_id=book_id).delete()
+        Client.query.filter(Client.id.in_(client_ids)).delete()
+        Book.query.filter_by(id=book_id).delete()
+        db.session.commit()
+
+    results.update({
+        'threads': threads,
+        'seconds': round(elapsed, 3),
+        'issues_per_second': round(threads * issues_per_thread / elapsed, 1),
+        'on_hand': on_hand,
+        'copies': copies,
+        'max_client_books': max_client_books,
+        'summary_mismatches': summary_mismatches,
+        'ok': (on_hand <= copies and max_client_books <= MAX_CLIENT_BOOKS and summary_mismatches == 0
+               and results['errors'] == 0),
+    })
+    return results
@@ -0,0 +1,121 @@
+import os
+import uuid
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import g
+from sqlalchemy import delete, update, func
+from sqlalchemy.exc import IntegrityError
+from models import db, ReportJob
+
+# Фоновое построение отчетов: запрос ставит задание в очередь и сразу получает его id,
+# отчет строится в пуле потоков и сохраняется в файл, страница отчетов опрашивает статус.
+# Одинаковые задания, которые еще в очереди или выполняются, объединяются в одно.
+# Длина очереди ограничена, чтобы всплеск отчетов не занял все подключения к базе.
+# Состояние заданий хранится в таблице report_jobs (migrations/013_report_jobs.sql), поэтому опрос
+# и скачивание работают в любом процессе приложения; строит отчет процесс, принявший задание.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE = (QUEUED, RUNNING)
+
+class JobQueueFull(Exception):
+    pass
+
+class ReportJobs:
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('REPORT_JOB_WORKERS', 2)
+        app.config.setdefault('REPORT_JOB_QUEUE_LIMIT', 10)
+        app.config.setdefault('REPORT_JOB_TTL', 600)
+        # Незавершенное дольше этого задание считается прерванным (процесс, который его строил, остановлен)
+        app.config.setdefault('REPORT_JOB_TIMEOUT', 3600)
+        # При нескольких серверах приложения каталог должен быть общим
+        app.config.setdefault('REPORT_JOB_DIR', os.path.join(app.instance_path, 'reports'))
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.app.config['REPORT_JOB_WORKERS'],
+                                                thread_name_prefix='report-job')
+        return self._executor
+
+    def _active(self, key):
+        return ReportJob.query.filter(ReportJob.key == key, ReportJob.status.in_(ACTIVE)).first()
+
+    def submit(self, key, render, download_name, mimetype):
+        key = str(key)
+        self._cleanup()
+        job = self._active(key)
+        if job is not None:
+            return job
+        if ReportJob.query.filter(ReportJob.status.in_(ACTIVE)).count() >= self.app.config['REPORT_JOB_QUEUE_LIMIT']:
+            raise JobQueueFull()
+        job = ReportJob(id=uuid.uuid4().hex, key=key, status=QUEUED, download_name=download_name,
+                        mimetype=mimetype)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Такое же задание только что поставил другой процесс (ix_report_jobs_active_key)
+            db.session.rollback()
+            job = self._active(key)
+            if job is None:
+                raise
+            return job
+        self.executor.submit(self._run, job.id, render)
+        return job
+
+    def get(self, job_id):
+        self._cleanup()
+        return db.session.get(ReportJob, job_id)
+
+    def _update(self, job_id, **values):
+        db.session.execute(update(ReportJob).where(ReportJob.id == job_id).values(**values))
+        db.session.commit()
+
+    def _run(self, job_id, render):
+        with self.app.app_context():
+            try:
+                self._update(job_id, status=RUNNING)
+                # Отчеты только читают данные и могут строиться на реплике
+                g.use_replica = True
+                try:
+                    data = render()
+                finally:
+                    g.use_replica = False
+                    db.session.remove()
+                os.makedirs(self.app.config['REPORT_JOB_DIR'], exist_ok=True)
+                path = os.path.join(self.app.config['REPORT_JOB_DIR'], job_id)
+                with open(path, 'wb') as f:
+                    f.write(data.encode('utf-8') if isinstance(data, str) else data)
+                self._update(job_id, status=DONE, path=path, finished_at=func.now())
+            except Exception as e:
+                self.app.logger.exception('Ошибка построения отчета %s', job_id)
+                db.session.rollback()
+                self._update(job_id, status=FAILED, error=str(e), finished_at=func.now())
+            finally:
+                db.session.remove()
+
+    def _cleanup(self):
+        # Удаляем завершенные задания старше REPORT_JOB_TTL вместе с файлами (при постановке задания,
+        # опросе статуса и скачивании); задания, прерванные остановкой процесса, отмечаем как ошибочные
+        now = func.now()
+        db.session.execute(update(ReportJob).where(
+            ReportJob.status.in_(ACTIVE),
+            ReportJob.created_at < now - timedelta(seconds=self.app.config['REPORT_JOB_TIMEOUT'])
+        ).values(status=FAILED, error='Построение отчета прервано', finished_at=now))
+        paths = db.session.scalars(delete(ReportJob).where(
+            ReportJob.finished_at < now - timedelta(seconds=self.app.config['REPORT_JOB_TTL'])
+        ).returning(ReportJob.path)).all()
+        db.session.commit()
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
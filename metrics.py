@@ -0,0 +1,127 @@
+import threading
+import time
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Замеры по запросам: время обработки, число SQL-запросов и суммарное время в базе по каждому view.
+# Итоги запроса отдаются в заголовке Server-Timing, накопленные счетчики - на /metrics в формате Prometheus.
+# SQL-запросы дольше SLOW_QUERY_MS пишутся в лог вместе с параметрами и view, из которого они вызваны.
+# Число запросов считает queries._count_query, здесь добавляется только время.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_LOGGED_PARAMETERS = 1000
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.slow_queries = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+class Metrics:
+    def __init__(self, app=None):
+        self._routes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('SLOW_QUERY_MS', 500)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    def _stats(self, view):
+        stats = self._routes.get(view)
+        if stats is None:
+            stats = self._routes[view] = RouteStats()
+        return stats
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.get('request_started')
+        if started is None or not current_app.config['METRICS_ENABLED']:
+            return response
+        duration = time.perf_counter() - started
+        db_time = g.get('db_time', 0.0)
+        queries = g.get('query_count', 0)
+        with self._lock:
+            stats = self._stats(request.endpoint or 'unknown')
+            stats.requests += 1
+            stats.duration += duration
+            stats.db_time += db_time
+            stats.queries += queries
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_time * 1000:.1f};desc="{queries} queries", app;dur={duration * 1000:.1f}'
+        )
+        return response
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        if not has_request_context():
+            view = None
+        else:
+            view = request.endpoint
+            g.db_time = g.get('db_time', 0.0) + elapsed
+        try:
+            threshold = current_app.config['SLOW_QUERY_MS']
+        except RuntimeError:
+            # Запрос вне контекста приложения (например, из отдельного скрипта) - не логируем
+            return
+        if threshold is not None and elapsed * 1000 >= threshold:
+            current_app.logger.warning(
+                'Медленный запрос (%.0f мс) во view %s: %s; параметры: %.*s',
+                elapsed * 1000, view or '-', statement, MAX_LOGGED_PARAMETERS, repr(parameters)
+            )
+            with self._lock:
+                self._stats(view or 'background').slow_queries += 1
+
+    def render(self):
+        # Текстовый формат Prometheus (text/plain; version=0.0.4)
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                '# HELP library_request_duration_seconds Время обработки запроса',
+                '# TYPE library_request_duration_seconds histogram',
+            ]
+            for view, stats in routes:
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats.requests}')
+                lines.append(f'library_request_duration_seconds_sum{{view="{view}"}} {stats.duration:.6f}')
+                lines.append(f'library_request_duration_seconds_count{{view="{view}"}} {stats.requests}')
+            for name, help_text, attr in (
+                ('library_db_queries_total', 'Число SQL-запросов', 'queries'),
+                ('library_db_seconds_total', 'Время выполнения SQL-запросов', 'db_time'),
+                ('library_slow_queries_total', 'Число медленных SQL-запросов', 'slow_queries'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in routes:
+                    value = getattr(stats, attr)
+                    lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _handle_error(context):
+    # Запрос завершился ошибкой и after_cursor_execute не будет вызван
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
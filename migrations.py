@@ -0,0 +1,33 @@
+import os
+from sqlalchemy import text
+from models import db
+
+# SQL-миграции из каталога migrations/ (триггеры, функции, индексы), применяются по порядку имен файлов.
+# Примененные версии хранятся в таблице schema_migrations.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def apply_migrations():
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version VARCHAR(100) PRIMARY KEY, '
+        'applied_at TIMESTAMP NOT NULL DEFAULT now())'
+    ))
+    db.session.commit()
+    
+    applied = set(db.session.execute(text('SELECT version FROM schema_migrations')).scalars())
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        version, ext = os.path.splitext(filename)
+        if ext != '.sql' or version in applied:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            db.session.connection().exec_driver_sql(sql)
+            db.session.execute(text('INSERT INTO schema_migrations (version) VALUES (:version)'),
+                               {'version': version})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        print(f'Applied migration {version}')
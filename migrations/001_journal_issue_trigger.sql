@@ -0,0 +1,42 @@
+-- Триггер на выдачу книги: книга должна быть в наличии, у клиента на руках меньше 10 книг.
+-- Строки клиента и книги блокируются, поэтому параллельные выдачи проверяются по очереди.
+
+CREATE OR REPLACE FUNCTION journal_check_issue() RETURNS trigger AS $$
+DECLARE
+    book_cnt integer;
+    issued integer;
+    client_books integer;
+BEGIN
+    IF NEW.date_ret IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+
+    PERFORM 1 FROM clients WHERE id = NEW.client_id FOR UPDATE;
+    SELECT cnt INTO book_cnt FROM books WHERE id = NEW.book_id FOR UPDATE;
+
+    SELECT count(*) INTO client_books
+    FROM journal
+    WHERE client_id = NEW.client_id AND date_ret IS NULL;
+
+    IF client_books >= 10 THEN
+        RAISE EXCEPTION 'Клиент не может взять больше 10 книг'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    SELECT count(*) INTO issued
+    FROM journal
+    WHERE book_id = NEW.book_id AND date_ret IS NULL;
+
+    IF issued >= book_cnt THEN
+        RAISE EXCEPTION 'Книга недоступна для выдачи (все экземпляры на руках)'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_check_issue ON journal;
+CREATE TRIGGER journal_check_issue
+    BEFORE INSERT ON journal
+    FOR EACH ROW EXECUTE FUNCTION journal_check_issue();
@@ -0,0 +1,62 @@
+-- Показатели для отчетов считаются хранимыми функциями.
+-- Популярность книг и максимальный штраф берутся из материализованных представлений,
+-- которые обновляются командой refresh-report-views или после изменений журнала.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS book_popularity AS
+SELECT b.id AS book_id,
+       b.name,
+       count(j.id) AS issue_count
+FROM books b
+JOIN journal j ON j.book_id = b.id
+GROUP BY b.id, b.name;
+
+-- Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS ix_book_popularity_book_id ON book_popularity (book_id);
+CREATE INDEX IF NOT EXISTS ix_book_popularity_issue_count ON book_popularity (issue_count DESC);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS fine_stats AS
+SELECT 1 AS id,
+       coalesce(max((j.date_ret - j.date_end) * bt.fine), 0) AS max_fine
+FROM journal j
+JOIN books b ON b.id = j.book_id
+JOIN book_types bt ON bt.id = b.type_id
+WHERE j.date_ret > j.date_end;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_fine_stats_id ON fine_stats (id);
+
+-- Число книг на руках у клиента
+CREATE OR REPLACE FUNCTION client_books_on_hand(p_client_id integer) RETURNS bigint AS $$
+    SELECT count(*)
+    FROM journal
+    WHERE client_id = p_client_id AND date_ret IS NULL;
+$$ LANGUAGE sql STABLE;
+
+-- Размер штрафа данного клиента
+CREATE OR REPLACE FUNCTION client_fine(p_client_id integer) RETURNS numeric AS $$
+    SELECT coalesce(sum((j.date_ret - j.date_end) * bt.fine), 0)
+    FROM journal j
+    JOIN books b ON b.id = j.book_id
+    JOIN book_types bt ON bt.id = b.type_id
+    WHERE j.client_id = p_client_id AND j.date_ret > j.date_end;
+$$ LANGUAGE sql STABLE;
+
+-- Размер самого большого штрафа
+CREATE OR REPLACE FUNCTION max_fine() RETURNS numeric AS $$
+    SELECT max_fine FROM fine_stats WHERE id = 1;
+$$ LANGUAGE sql STABLE;
+
+-- Самые популярные книги
+CREATE OR REPLACE FUNCTION top_books(p_limit integer DEFAULT 3)
+RETURNS TABLE (name varchar, issue_count bigint) AS $$
+    SELECT name, issue_count
+    FROM book_popularity
+    ORDER BY issue_count DESC, book_id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION refresh_report_views() RETURNS void AS $$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY book_popularity;
+    REFRESH MATERIALIZED VIEW CONCURRENTLY fine_stats;
+END;
+$$ LANGUAGE plpgsql;
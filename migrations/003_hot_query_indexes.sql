@@ -0,0 +1,21 @@
+-- Индексы для частых запросов к журналу и справочникам.
+-- Частичные индексы по date_ret IS NULL содержат только книги на руках и остаются маленькими
+-- при любом объеме истории. Проверка планов: flask check-plans.
+
+-- Число книг на руках у клиента (лимит 10 книг, триггер journal_check_issue)
+CREATE INDEX IF NOT EXISTS ix_journal_client_open ON journal (client_id) WHERE date_ret IS NULL;
+
+-- Число выданных экземпляров книги (Book.available, проверка наличия при выдаче)
+CREATE INDEX IF NOT EXISTS ix_journal_book_open ON journal (book_id) WHERE date_ret IS NULL;
+
+-- Просроченные книги: date_ret IS NULL AND date_end < current_date
+CREATE INDEX IF NOT EXISTS ix_journal_date_end_open ON journal (date_end) WHERE date_ret IS NULL;
+
+-- Вся история клиента (отчет по клиенту, штраф клиента)
+CREATE INDEX IF NOT EXISTS ix_journal_client_id ON journal (client_id);
+
+-- Проверка дубликата названия книги без учета регистра (books_add, импорт книг)
+CREATE INDEX IF NOT EXISTS ix_books_name_lower ON books (lower(name));
+
+-- Списки клиентов, отсортированные по фамилии
+CREATE INDEX IF NOT EXISTS ix_clients_last_name ON clients (last_name);
@@ -0,0 +1,161 @@
+-- Сводка по клиенту: число книг на руках, сумма начисленных штрафов и дата последней операции.
+-- Обновляется триггером на journal в той же транзакции, что и выдача, возврат или удаление записи,
+-- поэтому лимит в 10 книг и отчет по клиенту читают одну строку вместо всей истории клиента.
+-- Штраф начисляется при возврате по текущему тарифу типа книги; после изменения тарифов
+-- или ручной правки данных сводку можно пересчитать командой flask reconcile-client-summary.
+
+CREATE TABLE IF NOT EXISTS client_summary (
+    client_id integer PRIMARY KEY REFERENCES clients (id) ON DELETE CASCADE,
+    open_loans integer NOT NULL DEFAULT 0,
+    fines numeric(12, 2) NOT NULL DEFAULT 0,
+    last_activity date
+);
+
+-- Штраф по одной записи журнала (0, если книга не возвращена или возвращена в срок)
+CREATE OR REPLACE FUNCTION journal_loan_fine(p_book_id integer, p_date_end date, p_date_ret date)
+RETURNS numeric AS $$
+    SELECT CASE WHEN p_date_ret > p_date_end
+                THEN (p_date_ret - p_date_end) * coalesce((
+                    SELECT bt.fine
+                    FROM books b
+                    JOIN book_types bt ON bt.id = b.type_id
+                    WHERE b.id = p_book_id), 0)
+                ELSE 0 END;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION client_summary_apply(p_client_id integer, p_open_loans integer,
+                                                p_fines numeric, p_activity date) RETURNS void AS $$
+    INSERT INTO client_summary (client_id, open_loans, fines, last_activity)
+    VALUES (p_client_id, p_open_loans, p_fines, p_activity)
+    ON CONFLICT (client_id) DO UPDATE
+    SET open_loans = client_summary.open_loans + EXCLUDED.open_loans,
+        fines = client_summary.fines + EXCLUDED.fines,
+        last_activity = greatest(client_summary.last_activity, EXCLUDED.last_activity);
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION journal_client_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.client_id = OLD.client_id
+       AND NEW.book_id = OLD.book_id
+       AND NEW.date_beg = OLD.date_beg
+       AND NEW.date_end = OLD.date_end
+       AND NEW.date_ret IS NOT DISTINCT FROM OLD.date_ret THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возврат книги: одно изменение сводки на разницу между старой и новой версией строки
+    IF TG_OP = 'UPDATE' AND NEW.client_id = OLD.client_id THEN
+        PERFORM client_summary_apply(NEW.client_id,
+                                     (NEW.date_ret IS NULL)::integer - (OLD.date_ret IS NULL)::integer,
+                                     journal_loan_fine(NEW.book_id, NEW.date_end, NEW.date_ret)
+                                         - journal_loan_fine(OLD.book_id, OLD.date_end, OLD.date_ret),
+                                     greatest(NEW.date_beg, NEW.date_ret));
+        RETURN NULL;
+    END IF;
+
+    -- Старая версия строки вычитается из сводки, новая прибавляется
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM client_summary_apply(OLD.client_id,
+                                     -(OLD.date_ret IS NULL)::integer,
+                                     -journal_loan_fine(OLD.book_id, OLD.date_end, OLD.date_ret),
+                                     NULL);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM client_summary_apply(NEW.client_id,
+                                     (NEW.date_ret IS NULL)::integer,
+                                     journal_loan_fine(NEW.book_id, NEW.date_end, NEW.date_ret),
+                                     greatest(NEW.date_beg, NEW.date_ret));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Вставка в client_summary проверяет внешний ключ блокировкой FOR KEY SHARE строки клиента.
+-- Чтобы выдача не ждала возврат по тому же клиенту (и наоборот), клиент при выдаче блокируется
+-- FOR NO KEY UPDATE, которая с FOR KEY SHARE не конфликтует. Остальное как в 001_journal_issue_trigger.sql.
+CREATE OR REPLACE FUNCTION journal_check_issue() RETURNS trigger AS $$
+DECLARE
+    book_cnt integer;
+    issued integer;
+    client_books integer;
+BEGIN
+    IF NEW.date_ret IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+
+    PERFORM 1 FROM clients WHERE id = NEW.client_id FOR NO KEY UPDATE;
+    SELECT cnt INTO book_cnt FROM books WHERE id = NEW.book_id FOR UPDATE;
+
+    SELECT count(*) INTO client_books
+    FROM journal
+    WHERE client_id = NEW.client_id AND date_ret IS NULL;
+
+    IF client_books >= 10 THEN
+        RAISE EXCEPTION 'Клиент не может взять больше 10 книг'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    SELECT count(*) INTO issued
+    FROM journal
+    WHERE book_id = NEW.book_id AND date_ret IS NULL;
+
+    IF issued >= book_cnt THEN
+        RAISE EXCEPTION 'Книга недоступна для выдачи (все экземпляры на руках)'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_client_summary ON journal;
+CREATE TRIGGER journal_client_summary
+    AFTER INSERT OR UPDATE OR DELETE ON journal
+    FOR EACH ROW EXECUTE FUNCTION journal_client_summary();
+
+-- Полный пересчет сводки по журналу; возвращает число исправленных строк.
+-- Журнал блокируется от изменений на время пересчета, чтобы не потерять параллельные выдачи.
+CREATE OR REPLACE FUNCTION reconcile_client_summary() RETURNS integer AS $$
+DECLARE
+    changed integer;
+BEGIN
+    LOCK TABLE journal IN SHARE MODE;
+
+    WITH actual AS (
+        SELECT c.id AS client_id,
+               count(j.id) FILTER (WHERE j.date_ret IS NULL) AS open_loans,
+               coalesce(sum((j.date_ret - j.date_end) * coalesce(bt.fine, 0))
+                        FILTER (WHERE j.date_ret > j.date_end), 0) AS fines,
+               max(greatest(j.date_beg, j.date_ret)) AS last_activity
+        FROM clients c
+        LEFT JOIN journal j ON j.client_id = c.id
+        LEFT JOIN books b ON b.id = j.book_id
+        LEFT JOIN book_types bt ON bt.id = b.type_id
+        GROUP BY c.id
+    ), upserted AS (
+        INSERT INTO client_summary (client_id, open_loans, fines, last_activity)
+        SELECT client_id, open_loans, fines, last_activity FROM actual
+        ON CONFLICT (client_id) DO UPDATE
+        SET open_loans = EXCLUDED.open_loans,
+            fines = EXCLUDED.fines,
+            last_activity = EXCLUDED.last_activity
+        WHERE (client_summary.open_loans, client_summary.fines, client_summary.last_activity)
+              IS DISTINCT FROM (EXCLUDED.open_loans, EXCLUDED.fines, EXCLUDED.last_activity)
+        RETURNING 1
+    )
+    SELECT count(*) INTO changed FROM upserted;
+    RETURN changed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Показатели отчета по клиенту теперь читаются из сводки
+CREATE OR REPLACE FUNCTION client_books_on_hand(p_client_id integer) RETURNS bigint AS $$
+    SELECT coalesce((SELECT open_loans FROM client_summary WHERE client_id = p_client_id), 0)::bigint;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION client_fine(p_client_id integer) RETURNS numeric AS $$
+    SELECT coalesce((SELECT fines FROM client_summary WHERE client_id = p_client_id), 0);
+$$ LANGUAGE sql STABLE;
+
+SELECT reconcile_client_summary();
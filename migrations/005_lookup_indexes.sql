@@ -0,0 +1,7 @@
+-- Индексы для подсказок при выдаче книги (LIKE по началу строки).
+-- Класс операторов text_pattern_ops нужен, чтобы btree-индекс использовался для LIKE
+-- при любой локали базы.
+
+CREATE INDEX IF NOT EXISTS ix_clients_last_name_prefix ON clients (lower(last_name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_clients_passport_prefix ON clients ((passport_seria || passport_number) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_books_name_prefix ON books (lower(name) text_pattern_ops);
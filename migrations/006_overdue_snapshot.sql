@@ -0,0 +1,40 @@
+-- Снимок просроченных выдач для отчета по просрочкам и панели управления: отчет читает
+-- готовые строки со штрафом вместо соединения журнала со справочниками и расчета штрафа.
+-- Снимок строится заново функцией refresh_overdue_snapshot() (flask refresh-overdue-snapshot,
+-- запускать раз в сутки после полуночи, а также после изменения тарифов); возврат и удаление
+-- записи журнала убирают ее из снимка сразу, в той же транзакции.
+-- Штраф посчитан на дату построения снимка (built_on).
+
+CREATE TABLE IF NOT EXISTS overdue_snapshot (
+    journal_id integer PRIMARY KEY,
+    client_id integer NOT NULL REFERENCES clients (id) ON DELETE CASCADE,
+    book_id integer NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+    date_end date NOT NULL,
+    fine numeric(12, 2) NOT NULL,
+    built_on date NOT NULL
+);
+
+-- Отчет выводит записи по убыванию штрафа
+CREATE INDEX IF NOT EXISTS ix_overdue_snapshot_fine ON overdue_snapshot (fine DESC, journal_id);
+
+CREATE OR REPLACE FUNCTION refresh_overdue_snapshot() RETURNS integer AS $$
+DECLARE
+    built integer;
+BEGIN
+    -- Возвраты ждут окончания перестроения и удаляют уже новую строку;
+    -- чтение снимка во время перестроения не блокируется
+    LOCK TABLE overdue_snapshot IN EXCLUSIVE MODE;
+    DELETE FROM overdue_snapshot;
+    INSERT INTO overdue_snapshot (journal_id, client_id, book_id, date_end, fine, built_on)
+    SELECT j.id, j.client_id, j.book_id, j.date_end,
+           (current_date - j.date_end) * coalesce(bt.fine, 0), current_date
+    FROM journal j
+    JOIN books b ON b.id = j.book_id
+    LEFT JOIN book_types bt ON bt.id = b.type_id
+    WHERE j.date_ret IS NULL AND j.date_end < current_date;
+    GET DIAGNOSTICS built = ROW_COUNT;
+    RETURN built;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_overdue_snapshot();
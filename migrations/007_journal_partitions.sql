@@ -0,0 +1,252 @@
+-- Секционирование журнала. Верхний уровень - по archived: рабочие секции journal_hot (книги на руках
+-- и недавние возвраты) и архив journal_archive (книги, возвращенные давно); обе делятся по годам date_beg.
+-- Запросы по книгам на руках содержат условие NOT archived (Journal.is_open) и читают только рабочие секции,
+-- отчеты по всей истории (популярные книги, максимальный штраф, история клиента) читают весь журнал.
+-- Перенос в архив и секции на следующий год: flask archive-journal (раз в сутки вместе с
+-- refresh-overdue-snapshot). Записи за годы без своей секции попадают в секцию DEFAULT.
+--
+-- Для новой базы таблицу journal уже создал db.create_all по модели Journal. Существующая таблица
+-- переименовывается, данные копируются в новую секционированную таблицу; материализованные
+-- представления, индексы и триггеры создаются заново.
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'journal'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    DROP MATERIALIZED VIEW IF EXISTS book_popularity;
+    DROP MATERIALIZED VIEW IF EXISTS fine_stats;
+    ALTER TABLE journal RENAME TO journal_unpartitioned;
+    ALTER INDEX journal_pkey RENAME TO journal_unpartitioned_pkey;
+    ALTER SEQUENCE journal_id_seq OWNED BY NONE;
+
+    -- Первичный ключ секционированной таблицы должен включать ключи секционирования
+    CREATE TABLE journal (
+        id integer NOT NULL DEFAULT nextval('journal_id_seq'),
+        client_id integer NOT NULL REFERENCES clients (id),
+        book_id integer NOT NULL REFERENCES books (id),
+        date_beg date NOT NULL,
+        date_end date NOT NULL,
+        date_ret date,
+        archived boolean NOT NULL DEFAULT false,
+        PRIMARY KEY (id, archived, date_beg)
+    ) PARTITION BY LIST (archived);
+    ALTER SEQUENCE journal_id_seq OWNED BY journal.id;
+END $$;
+
+CREATE TABLE IF NOT EXISTS journal_hot PARTITION OF journal FOR VALUES IN (false) PARTITION BY RANGE (date_beg);
+CREATE TABLE IF NOT EXISTS journal_archive PARTITION OF journal FOR VALUES IN (true) PARTITION BY RANGE (date_beg);
+CREATE TABLE IF NOT EXISTS journal_hot_default PARTITION OF journal_hot DEFAULT;
+CREATE TABLE IF NOT EXISTS journal_archive_default PARTITION OF journal_archive DEFAULT;
+
+-- Секции по годам с p_from по p_to включительно в рабочей и архивной части журнала.
+-- Если записи за год уже лежат в секции DEFAULT, секция за этот год не создается.
+CREATE OR REPLACE FUNCTION journal_create_partitions(p_from integer, p_to integer) RETURNS integer AS $$
+DECLARE
+    parent text;
+    partition text;
+    y integer;
+    has_rows boolean;
+    created integer := 0;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['journal_hot', 'journal_archive'] LOOP
+        FOR y IN p_from..p_to LOOP
+            partition := parent || '_' || y;
+            CONTINUE WHEN to_regclass(partition) IS NOT NULL;
+            EXECUTE 'SELECT EXISTS (SELECT 1 FROM ' || quote_ident(parent || '_default')
+                    || ' WHERE date_beg >= $1 AND date_beg < $2)'
+                INTO has_rows USING make_date(y, 1, 1), make_date(y + 1, 1, 1);
+            IF has_rows THEN
+                RAISE NOTICE USING MESSAGE = 'Записи за год ' || y || ' уже в секции ' || parent || '_default';
+                CONTINUE;
+            END IF;
+            EXECUTE 'CREATE TABLE ' || quote_ident(partition) || ' PARTITION OF ' || quote_ident(parent)
+                    || ' FOR VALUES FROM (' || quote_literal(make_date(y, 1, 1)) || ') TO ('
+                    || quote_literal(make_date(y + 1, 1, 1)) || ')';
+            created := created + 1;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    this_year integer := extract(year FROM current_date)::integer;
+BEGIN
+    IF to_regclass('journal_unpartitioned') IS NULL THEN
+        PERFORM journal_create_partitions(this_year, this_year + 1);
+        RETURN;
+    END IF;
+
+    PERFORM journal_create_partitions(
+        least(coalesce((SELECT extract(year FROM min(date_beg))::integer FROM journal_unpartitioned), this_year),
+              this_year),
+        this_year + 1);
+    -- Триггеров на новой таблице еще нет: сводка по клиентам уже соответствует этим данным
+    INSERT INTO journal (id, client_id, book_id, date_beg, date_end, date_ret)
+    SELECT id, client_id, book_id, date_beg, date_end, date_ret FROM journal_unpartitioned;
+    DROP TABLE journal_unpartitioned;
+END $$;
+
+-- Индексы из 003_hot_query_indexes.sql (на секционированной таблице создаются в каждой секции)
+CREATE INDEX IF NOT EXISTS ix_journal_client_open ON journal (client_id) WHERE date_ret IS NULL;
+CREATE INDEX IF NOT EXISTS ix_journal_book_open ON journal (book_id) WHERE date_ret IS NULL;
+CREATE INDEX IF NOT EXISTS ix_journal_date_end_open ON journal (date_end) WHERE date_ret IS NULL;
+CREATE INDEX IF NOT EXISTS ix_journal_client_id ON journal (client_id);
+-- Выбор записей для переноса в архив
+CREATE INDEX IF NOT EXISTS ix_journal_hot_date_ret ON journal_hot (date_ret) WHERE date_ret IS NOT NULL;
+
+-- Представления для отчетов из 002_report_functions.sql
+CREATE MATERIALIZED VIEW IF NOT EXISTS book_popularity AS
+SELECT b.id AS book_id,
+       b.name,
+       count(j.id) AS issue_count
+FROM books b
+JOIN journal j ON j.book_id = b.id
+GROUP BY b.id, b.name;
+
+-- Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS ix_book_popularity_book_id ON book_popularity (book_id);
+CREATE INDEX IF NOT EXISTS ix_book_popularity_issue_count ON book_popularity (issue_count DESC);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS fine_stats AS
+SELECT 1 AS id,
+       coalesce(max((j.date_ret - j.date_end) * bt.fine), 0) AS max_fine
+FROM journal j
+JOIN books b ON b.id = j.book_id
+JOIN book_types bt ON bt.id = b.type_id
+WHERE j.date_ret > j.date_end;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_fine_stats_id ON fine_stats (id);
+
+-- Проверка выдачи считает только рабочие секции (в архиве книг на руках нет)
+CREATE OR REPLACE FUNCTION journal_check_issue() RETURNS trigger AS $$
+DECLARE
+    book_cnt integer;
+    issued integer;
+    client_books integer;
+BEGIN
+    IF NEW.date_ret IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+
+    PERFORM 1 FROM clients WHERE id = NEW.client_id FOR NO KEY UPDATE;
+    SELECT cnt INTO book_cnt FROM books WHERE id = NEW.book_id FOR UPDATE;
+
+    SELECT count(*) INTO client_books
+    FROM journal
+    WHERE client_id = NEW.client_id AND date_ret IS NULL AND NOT archived;
+
+    IF client_books >= 10 THEN
+        RAISE EXCEPTION 'Клиент не может взять больше 10 книг'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    SELECT count(*) INTO issued
+    FROM journal
+    WHERE book_id = NEW.book_id AND date_ret IS NULL AND NOT archived;
+
+    IF issued >= book_cnt THEN
+        RAISE EXCEPTION 'Книга недоступна для выдачи (все экземпляры на руках)'
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION journal_client_summary() RETURNS trigger AS $$
+BEGIN
+    -- Перенос в архив (archive_journal) удаляет строку из рабочей секции и вставляет в архивную,
+    -- данные записи при этом не меняются
+    IF current_setting('library.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'UPDATE'
+       AND NEW.client_id = OLD.client_id
+       AND NEW.book_id = OLD.book_id
+       AND NEW.date_beg = OLD.date_beg
+       AND NEW.date_end = OLD.date_end
+       AND NEW.date_ret IS NOT DISTINCT FROM OLD.date_ret THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возврат книги: одно изменение сводки на разницу между старой и новой версией строки
+    IF TG_OP = 'UPDATE' AND NEW.client_id = OLD.client_id THEN
+        PERFORM client_summary_apply(NEW.client_id,
+                                     (NEW.date_ret IS NULL)::integer - (OLD.date_ret IS NULL)::integer,
+                                     journal_loan_fine(NEW.book_id, NEW.date_end, NEW.date_ret)
+                                         - journal_loan_fine(OLD.book_id, OLD.date_end, OLD.date_ret),
+                                     greatest(NEW.date_beg, NEW.date_ret));
+        RETURN NULL;
+    END IF;
+
+    -- Старая версия строки вычитается из сводки, новая прибавляется
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM client_summary_apply(OLD.client_id,
+                                     -(OLD.date_ret IS NULL)::integer,
+                                     -journal_loan_fine(OLD.book_id, OLD.date_end, OLD.date_ret),
+                                     NULL);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM client_summary_apply(NEW.client_id,
+                                     (NEW.date_ret IS NULL)::integer,
+                                     journal_loan_fine(NEW.book_id, NEW.date_end, NEW.date_ret),
+                                     greatest(NEW.date_beg, NEW.date_ret));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_check_issue ON journal;
+CREATE TRIGGER journal_check_issue
+    BEFORE INSERT ON journal
+    FOR EACH ROW EXECUTE FUNCTION journal_check_issue();
+
+DROP TRIGGER IF EXISTS journal_client_summary ON journal;
+CREATE TRIGGER journal_client_summary
+    AFTER INSERT OR UPDATE OR DELETE ON journal
+    FOR EACH ROW EXECUTE FUNCTION journal_client_summary();
+
+-- Снимок просрочек из 006_overdue_snapshot.sql: просроченные выдачи ищутся только в рабочих секциях
+CREATE OR REPLACE FUNCTION refresh_overdue_snapshot() RETURNS integer AS $$
+DECLARE
+    built integer;
+BEGIN
+    LOCK TABLE overdue_snapshot IN EXCLUSIVE MODE;
+    DELETE FROM overdue_snapshot;
+    INSERT INTO overdue_snapshot (journal_id, client_id, book_id, date_end, fine, built_on)
+    SELECT j.id, j.client_id, j.book_id, j.date_end,
+           (current_date - j.date_end) * coalesce(bt.fine, 0), current_date
+    FROM journal j
+    JOIN books b ON b.id = j.book_id
+    LEFT JOIN book_types bt ON bt.id = b.type_id
+    WHERE j.date_ret IS NULL AND NOT j.archived AND j.date_end < current_date;
+    GET DIAGNOSTICS built = ROW_COUNT;
+    RETURN built;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос в архив возвращенных раньше p_before; за вызов не больше p_limit записей,
+-- возвращает число перенесенных. Строка переходит в архивную секцию при изменении archived.
+CREATE OR REPLACE FUNCTION archive_journal(p_before date, p_limit integer) RETURNS integer AS $$
+DECLARE
+    moved integer;
+BEGIN
+    PERFORM set_config('library.archiving', 'on', true);
+    UPDATE journal SET archived = true
+    WHERE NOT archived
+      AND id IN (SELECT id FROM journal
+                 WHERE NOT archived AND date_ret < p_before
+                 ORDER BY date_ret
+                 LIMIT p_limit);
+    GET DIAGNOSTICS moved = ROW_COUNT;
+    PERFORM set_config('library.archiving', 'off', true);
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+ANALYZE journal;
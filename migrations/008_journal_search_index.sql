@@ -0,0 +1,4 @@
+-- Поиск по журналу (search.journal_search_filter) выбирает записи по найденным клиентам и книгам:
+-- journal(client_id) уже есть (003_hot_query_indexes.sql), здесь индекс по всем записям книги
+-- (ix_journal_book_open содержит только книги на руках).
+CREATE INDEX IF NOT EXISTS ix_journal_book_id ON journal (book_id);
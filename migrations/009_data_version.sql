@@ -0,0 +1,43 @@
+-- Версия данных для ETag и Last-Modified в JSON API. Одна строка на всю базу, поэтому версия
+-- одна и та же во всех процессах и на всех серверах приложения, а после перезапуска не сбрасывается.
+-- Увеличивается триггерами на journal, books, clients и book_types при любом изменении этих таблиц.
+-- Ключ кэша готовых отчетов тоже включает эту версию, поэтому после обновления представлений отчетов
+-- и снимка просрочек она увеличивается явно (reports.touch_data_version).
+-- Триггер отложенный: строка версии обновляется один раз при фиксации транзакции и блокируется
+-- только на время фиксации, поэтому параллельные выдачи и возвраты не ждут друг друга на ней.
+-- Новое значение видно вместе с изменениями, которые его вызвали.
+
+CREATE TABLE IF NOT EXISTS data_version (
+    id integer PRIMARY KEY CHECK (id = 1),
+    version bigint NOT NULL,
+    updated_at timestamptz NOT NULL
+);
+
+-- Начальная версия - время создания: в заново созданной базе ETag не совпадет с прежними
+INSERT INTO data_version (id, version, updated_at)
+VALUES (1, extract(epoch FROM clock_timestamp())::bigint, clock_timestamp())
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    -- Триггер срабатывает на каждую строку, версия увеличивается один раз за транзакцию
+    IF current_setting('library.data_version_bumped', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM set_config('library.data_version_bumped', 'on', true);
+    UPDATE data_version SET version = version + 1, updated_at = clock_timestamp() WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['journal', 'books', 'clients', 'book_types'] LOOP
+        EXECUTE 'DROP TRIGGER IF EXISTS ' || quote_ident(tbl || '_data_version') || ' ON ' || quote_ident(tbl);
+        EXECUTE 'CREATE CONSTRAINT TRIGGER ' || quote_ident(tbl || '_data_version')
+                || ' AFTER INSERT OR UPDATE OR DELETE ON ' || quote_ident(tbl)
+                || ' DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION bump_data_version()';
+    END LOOP;
+END $$;
@@ -0,0 +1,5 @@
+-- Поиск по каталогу (search.book_search_filter): типы книг ищутся по триграммному индексу,
+-- книги найденных типов выбираются по индексу books(type_id); он же нужен для пересчета
+-- снимка просрочек по типу книги.
+CREATE INDEX IF NOT EXISTS ix_book_types_type_trgm ON book_types USING gin (type gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_books_type_id ON books (type_id);
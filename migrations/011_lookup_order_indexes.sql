@@ -0,0 +1,13 @@
+-- Индексы подсказок из 005_lookup_indexes.sql с порядком строк, как в ORDER BY подсказок.
+-- Индекс с text_pattern_ops находит строки по LIKE по началу строки, но не отдает их в порядке
+-- ORDER BY lower(last_name): перед LIMIT сортировались все совпадения, а для коротких начал
+-- ("и") это большая часть таблицы. Подсказки сортируются побайтово (COLLATE "C"); индекс
+-- с той же сортировкой и id находит строки по LIKE и сразу отдает первые LIMIT из них.
+
+DROP INDEX IF EXISTS ix_clients_last_name_prefix;
+DROP INDEX IF EXISTS ix_clients_passport_prefix;
+DROP INDEX IF EXISTS ix_books_name_prefix;
+
+CREATE INDEX IF NOT EXISTS ix_clients_last_name_lookup ON clients ((lower(last_name) COLLATE "C"), id);
+CREATE INDEX IF NOT EXISTS ix_clients_passport_lookup ON clients (((passport_seria || passport_number) COLLATE "C"), id);
+CREATE INDEX IF NOT EXISTS ix_books_name_lookup ON books ((lower(name) COLLATE "C"), id);
@@ -0,0 +1,66 @@
+-- Секции журнала за год, записи которого уже лежат в секции DEFAULT. Раньше такой год пропускался
+-- (journal_create_partitions из 007_journal_partitions.sql) и оставался в DEFAULT навсегда, а каждая
+-- новая запись за него увеличивала секцию, которую читают все запросы без условия по date_beg.
+-- Теперь секция DEFAULT отсоединяется, записи за год переносятся в новую таблицу, она подключается
+-- секцией за этот год, а DEFAULT подключается обратно. Все это одна транзакция; отсоединение
+-- блокирует journal_hot (journal_archive) до ее конца, поэтому секции создаются заранее
+-- (flask migrate и flask archive-journal создают их на текущий и следующий год), а перенос
+-- нужен только для записей, попавших в DEFAULT до этого.
+-- Отсоединенная секция и новая таблица без триггеров: перенос не меняет сводку по клиентам
+-- и версию данных, проверка выдачи для перенесенных записей не выполняется.
+
+CREATE OR REPLACE FUNCTION journal_create_partitions(p_from integer, p_to integer) RETURNS integer AS $$
+DECLARE
+    parent text;
+    default_partition text;
+    partition text;
+    y integer;
+    has_rows boolean;
+    created integer := 0;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['journal_hot', 'journal_archive'] LOOP
+        default_partition := parent || '_default';
+        FOR y IN p_from..p_to LOOP
+            partition := parent || '_' || y;
+            CONTINUE WHEN to_regclass(partition) IS NOT NULL;
+            EXECUTE 'SELECT EXISTS (SELECT 1 FROM ' || quote_ident(default_partition)
+                    || ' WHERE date_beg >= $1 AND date_beg < $2)'
+                INTO has_rows USING make_date(y, 1, 1), make_date(y + 1, 1, 1);
+            IF has_rows THEN
+                EXECUTE 'ALTER TABLE ' || quote_ident(parent) || ' DETACH PARTITION ' || quote_ident(default_partition);
+                EXECUTE 'CREATE TABLE ' || quote_ident(partition) || ' (LIKE ' || quote_ident(parent)
+                        || ' INCLUDING DEFAULTS)';
+                EXECUTE 'WITH moved AS (DELETE FROM ' || quote_ident(default_partition)
+                        || ' WHERE date_beg >= $1 AND date_beg < $2'
+                        || ' RETURNING id, client_id, book_id, date_beg, date_end, date_ret, archived)'
+                        || ' INSERT INTO ' || quote_ident(partition)
+                        || ' (id, client_id, book_id, date_beg, date_end, date_ret, archived)'
+                        || ' SELECT id, client_id, book_id, date_beg, date_end, date_ret, archived FROM moved'
+                    USING make_date(y, 1, 1), make_date(y + 1, 1, 1);
+                EXECUTE 'ALTER TABLE ' || quote_ident(parent) || ' ATTACH PARTITION ' || quote_ident(partition)
+                        || ' FOR VALUES FROM (' || quote_literal(make_date(y, 1, 1)) || ') TO ('
+                        || quote_literal(make_date(y + 1, 1, 1)) || ')';
+                EXECUTE 'ALTER TABLE ' || quote_ident(parent) || ' ATTACH PARTITION ' || quote_ident(default_partition)
+                        || ' DEFAULT';
+            ELSE
+                EXECUTE 'CREATE TABLE ' || quote_ident(partition) || ' PARTITION OF ' || quote_ident(parent)
+                        || ' FOR VALUES FROM (' || quote_literal(make_date(y, 1, 1)) || ') TO ('
+                        || quote_literal(make_date(y + 1, 1, 1)) || ')';
+            END IF;
+            created := created + 1;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Годы, которые уже лежат в секциях DEFAULT
+DO $$
+DECLARE
+    this_year integer := extract(year FROM current_date)::integer;
+    first_year integer;
+BEGIN
+    SELECT extract(year FROM min(date_beg))::integer INTO first_year
+    FROM (SELECT date_beg FROM journal_hot_default UNION ALL SELECT date_beg FROM journal_archive_default) d;
+    PERFORM journal_create_partitions(least(coalesce(first_year, this_year), this_year), this_year + 1);
+END $$;
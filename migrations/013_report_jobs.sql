@@ -0,0 +1,21 @@
+-- Задания фонового построения отчетов (jobs.py). Раньше состояние заданий хранилось в памяти
+-- процесса: при нескольких процессах приложения опрос статуса или скачивание, попавшие в другой
+-- процесс, получали 404, а одинаковые задания из разных процессов не объединялись.
+-- Файлы отчетов лежат в REPORT_JOB_DIR, при нескольких серверах этот каталог должен быть общим.
+
+CREATE TABLE IF NOT EXISTS report_jobs (
+    id varchar(32) PRIMARY KEY,
+    key varchar(200) NOT NULL,
+    status varchar(10) NOT NULL,
+    download_name varchar(200) NOT NULL,
+    mimetype varchar(100) NOT NULL,
+    path varchar(500),
+    error text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    finished_at timestamptz
+);
+
+-- Одно незавершенное задание на ключ: одинаковые запросы из разных процессов получают одно задание
+CREATE UNIQUE INDEX IF NOT EXISTS ix_report_jobs_active_key ON report_jobs (key)
+    WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS ix_report_jobs_finished_at ON report_jobs (finished_at);
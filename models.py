@@ -1,8 +1,17 @@
+from datetime import date
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def trigram_index(table, column):
+    # Триграммный GIN-индекс для поиска подстроки через ILIKE (нужно расширение pg_trgm)
+    return db.Index(f'ix_{table}_{column}_trgm', column,
+                    postgresql_using='gin',
+                    postgresql_ops={column: 'gin_trgm_ops'})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -34,6 +43,25 @@ class Client(db.Model):
     passport_seria = db.Column(db.String(4))
     passport_number = db.Column(db.String(6))
 
+    __table_args__ = (
+        trigram_index('clients', 'last_name'),
+        trigram_index('clients', 'first_name'),
+        trigram_index('clients', 'father_name'),
+        trigram_index('clients', 'passport_seria'),
+        trigram_index('clients', 'passport_number'),
+    )
+
+class ClientSummary(db.Model):
+    # Сводка по клиенту, поддерживается триггером journal_client_summary (migrations/004_client_summary.sql)
+    __tablename__ = 'client_summary'
+
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id', ondelete='CASCADE'), primary_key=True)
+    open_loans = db.Column(db.Integer, nullable=False, default=0)
+    fines = db.Column(db.Numeric(12,2), nullable=False, default=0)
+    last_activity = db.Column(db.Date)
+
+    client = db.relationship('Client', backref=db.backref('summary', uselist=False, passive_deletes=True))
+
 class BookType(db.Model):
     __tablename__ = 'book_types'
     
@@ -49,18 +77,137 @@ class Book(db.Model):
     name = db.Column(db.String(100))
     cnt = db.Column(db.Integer)
     type_id = db.Column(db.Integer, db.ForeignKey('book_types.id'))
+
+    __table_args__ = (
+        trigram_index('books', 'name'),
+    )
     
     book_type = db.relationship('BookType', backref='books')
 
 class Journal(db.Model):
+    # Секционированная таблица (migrations/007_journal_partitions.sql): сначала по archived
+    # (рабочие записи и архив возвращенных), затем по годам date_beg. Ключ секционирования
+    # должен входить в первичный ключ таблицы, в ORM записи по-прежнему определяются по id.
     __tablename__ = 'journal'
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, autoincrement=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     date_beg = db.Column(db.Date, nullable=False)
     date_end = db.Column(db.Date, nullable=False)
     date_ret = db.Column(db.Date)
+    # Возвращенная давно запись перенесена в архивные секции (flask archive-journal)
+    archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('id', 'archived', 'date_beg'),
+        {'postgresql_partition_by': 'LIST (archived)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
     
     client = db.relationship('Client', backref=db.backref('journal_entries', lazy=True))
-    book = db.relationship('Book', backref=db.backref('journal_entries', lazy=True)) 
\ No newline at end of file
+    book = db.relationship('Book', backref=db.backref('journal_entries', lazy=True)) 
+
+    # Дни просрочки при возврате. Штраф начисляется только за возвращенные книги (как в
+    # journal_loan_fine, migrations/004_client_summary.sql), у книг на руках дней просрочки 0
+    @hybrid_property
+    def days_overdue(self):
+        if self.date_ret is None:
+            return 0
+        return max((self.date_ret - self.date_end).days, 0)
+
+    @days_overdue.expression
+    def days_overdue(cls):
+        return db.case((cls.date_ret > cls.date_end, cls.date_ret - cls.date_end), else_=0)
+
+    # Книга на руках. В архиве только возвращенные книги, условие по archived нужно,
+    # чтобы запрос читал только рабочие секции журнала
+    @hybrid_property
+    def is_open(self):
+        return self.date_ret is None
+
+    @is_open.expression
+    def is_open(cls):
+        return db.and_(cls.archived.is_(False), cls.date_ret.is_(None))
+
+    # Книга на руках и срок возврата прошел
+    @hybrid_property
+    def is_overdue(self):
+        return self.date_ret is None and self.date_end < date.today()
+
+    @is_overdue.expression
+    def is_overdue(cls):
+        return db.and_(cls.is_open, cls.date_end < db.func.current_date())
+
+# Число доступных экземпляров (cnt минус книги на руках), считается в том же запросе, что и сами книги
+Book.available = db.column_property(
+    Book.cnt - db.select(db.func.count(Journal.id)).where(
+        Journal.book_id == Book.id,
+        Journal.is_open
+    ).correlate_except(Journal).scalar_subquery(),
+    deferred=True
+)
+
+# Штраф по записи журнала (дни просрочки при возврате * штраф за день для типа книги), считается в запросе
+# к журналу, поэтому по нему можно сортировать и фильтровать без обхода связей в Python. Та же формула,
+# что в сводке по клиенту и отчетах; штраф, набежавший по книгам на руках, - в снимке просрочек
+Journal.fine = db.column_property(
+    Journal.days_overdue * db.func.coalesce(
+        db.select(BookType.fine).join(Book, Book.type_id == BookType.id).where(
+            Book.id == Journal.book_id
+        ).correlate_except(Book, BookType).scalar_subquery(),
+        0
+    ),
+    deferred=True
+)
+
+class OverdueSnapshot(db.Model):
+    # Снимок просроченных выдач, строится refresh_overdue_snapshot() (migrations/006_overdue_snapshot.sql)
+    __tablename__ = 'overdue_snapshot'
+
+    journal_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id', ondelete='CASCADE'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    date_end = db.Column(db.Date, nullable=False)
+    fine = db.Column(db.Numeric(12,2), nullable=False)
+    built_on = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_overdue_snapshot_fine', fine.desc(), journal_id),
+    )
+
+    client = db.relationship('Client', backref=db.backref('overdue_entries', passive_deletes=True))
+    book = db.relationship('Book', backref=db.backref('overdue_entries', passive_deletes=True))
+
+class DataVersion(db.Model):
+    # Версия данных для JSON API, увеличивается триггерами (migrations/009_data_version.sql)
+    __tablename__ = 'data_version'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+class ReportJob(db.Model):
+    # Задание фонового построения отчета (jobs.py, migrations/013_report_jobs.sql). Состояние хранится
+    # в базе, поэтому статус и файл доступны из любого процесса приложения
+    __tablename__ = 'report_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(10), nullable=False)
+    download_name = db.Column(db.String(200), nullable=False)
+    mimetype = db.Column(db.String(100), nullable=False)
+    path = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        # Одно незавершенное задание на ключ во всех процессах
+        db.Index('ix_report_jobs_active_key', key, unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+        db.Index('ix_report_jobs_finished_at', finished_at),
+    )
+
+    def as_dict(self):
+        return {'id': self.id, 'status': self.status, 'error': self.error}
@@ -0,0 +1,119 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import or_, and_, tuple_
+from models import db
+
+# Постраничный вывод по ключу (keyset): следующая страница выбирается условием
+# (колонка сортировки, id) > (значения последней строки), без OFFSET и без COUNT(*)
+
+def encode_cursor(value, id):
+    if isinstance(value, (date, datetime, Decimal)):
+        value = str(value)
+    raw = json.dumps([value, id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _cursor_value(value, column):
+    # Значение из курсора приводится к типу колонки; курсор приходит из адреса и может быть подделан
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if python_type in (date, datetime, Decimal):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        value = Decimal(value)
+        if not value.is_finite():
+            raise ValueError(value)
+        return value
+    if python_type is int and (isinstance(value, bool) or not isinstance(value, int)):
+        raise TypeError(value)
+    if python_type is float and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise TypeError(value)
+    if python_type is str and not isinstance(value, str):
+        raise TypeError(value)
+    if python_type is None and not isinstance(value, (str, int, float)):
+        raise TypeError(value)
+    return value
+
+def decode_cursor(cursor, column):
+    # Неверный курсор - вывод с первой страницы
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if isinstance(id, bool) or not isinstance(id, int):
+            raise TypeError(id)
+        if value is not None:
+            value = _cursor_value(value, column)
+    except (ValueError, TypeError, ArithmeticError):
+        return None
+    return value, id
+
+def estimate_count(query):
+    # Оценка числа строк по статистике планировщика PostgreSQL (EXPLAIN), без выполнения запроса
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    statement = query.order_by(None).statement
+    compiled = statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def keyset_statement(query, sort_column, id_column, after=None, per_page=10):
+    # Условие по курсору, сортировка и LIMIT; query - Query или select() (асинхронный режим, asgi.py)
+    nullable = getattr(sort_column.expression, 'nullable', False)
+    cursor = decode_cursor(after, sort_column) if after else None
+    if cursor is not None:
+        value, last_id = cursor
+        if value is None:
+            # NULL сортируются последними: дальше идут только NULL с большим id
+            query = query.filter(and_(sort_column.is_(None), id_column > last_id))
+        elif nullable:
+            query = query.filter(or_(
+                tuple_(sort_column, id_column) > tuple_(value, last_id),
+                sort_column.is_(None)
+            ))
+        else:
+            query = query.filter(tuple_(sort_column, id_column) > tuple_(value, last_id))
+
+    if sort_column is id_column:
+        query = query.order_by(id_column)
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), id_column)
+
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    return query.limit(per_page + 1)
+
+def keyset_page(rows, sort_column, id_column, per_page=10):
+    # Строки страницы и курсор следующей страницы (None на последней) по результату keyset_statement
+    items = rows[:per_page]
+    if len(rows) > per_page:
+        last = items[-1]
+        return items, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return items, None
+
+class KeysetPagination:
+    keyset = True
+
+    def __init__(self, query, sort_column, id_column, after=None, per_page=10, total='estimate'):
+        self.per_page = per_page
+        self.after = after or ''
+
+        query = query.order_by(None)
+        if total == 'exact':
+            self.total = query.count()
+        elif total == 'estimate':
+            self.total = estimate_count(query)
+        else:
+            self.total = None
+
+        rows = keyset_statement(query, sort_column, id_column, after, per_page).all()
+        self.items, self.next_cursor = keyset_page(rows, sort_column, id_column, per_page)
+        self.has_next = self.next_cursor is not None
@@ -0,0 +1,109 @@
+import threading
+from flask import current_app
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+
+# Построение PDF-отчетов: шрифт с кириллицей регистрируется один раз при запуске,
+# строки переносятся на новые страницы автоматически, таблицы заполняются из итератора строк.
+# Содержимое страниц сжимается, поэтому на больших отчетах объем памяти растет медленно,
+# а сами строки данных в памяти не накапливаются.
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN_LEFT = 50
+MARGIN_RIGHT = 50
+MARGIN_TOP = 42
+MARGIN_BOTTOM = 50
+
+_fonts_lock = threading.Lock()
+_font_error = None
+
+def init_pdf(app):
+    global _font_error
+    app.config.setdefault('PDF_FONT_NAME', 'Arial')
+    app.config.setdefault('PDF_FONT_FILE', 'arial.ttf')
+    with _fonts_lock:
+        try:
+            pdfmetrics.registerFont(TTFont(app.config['PDF_FONT_NAME'], app.config['PDF_FONT_FILE']))
+            _font_error = None
+        except TTFError as e:
+            # Приложение работает и без шрифта, ошибка будет показана при построении отчета
+            _font_error = e
+            app.logger.warning('Шрифт для PDF-отчетов не найден: %s', e)
+
+def fit_text(text, font_name, font_size, width):
+    # Обрезает текст, чтобы он поместился в колонку заданной ширины
+    text = str(text)
+    if pdfmetrics.stringWidth(text, font_name, font_size) <= width:
+        return text
+    while text and pdfmetrics.stringWidth(text + '…', font_name, font_size) > width:
+        text = text[:-1]
+    return text + '…'
+
+class PdfReport:
+    def __init__(self, output, title, font_size=12, line_height=20):
+        if _font_error is not None:
+            raise _font_error
+        self.font_name = current_app.config['PDF_FONT_NAME']
+        self.font_size = font_size
+        self.line_height = line_height
+        self.canvas = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+        self.canvas.setTitle(title)
+        self.page_header = None
+        self.y = PAGE_HEIGHT - MARGIN_TOP
+
+        # Заголовок отчета
+        self.canvas.setFont(self.font_name, 14)
+        self.canvas.drawString(MARGIN_LEFT, self.y, title)
+        self.y -= self.line_height * 1.5
+        self.canvas.setFont(self.font_name, self.font_size)
+
+    def new_page(self):
+        self.canvas.showPage()
+        # После showPage шрифт сбрасывается
+        self.canvas.setFont(self.font_name, self.font_size)
+        self.y = PAGE_HEIGHT - MARGIN_TOP
+        if self.page_header:
+            self.page_header()
+
+    def _ensure_space(self, height):
+        if self.y - height < MARGIN_BOTTOM:
+            self.new_page()
+
+    def line(self, text, indent=0, height=None):
+        height = height or self.line_height
+        self._ensure_space(height)
+        width = PAGE_WIDTH - MARGIN_LEFT - MARGIN_RIGHT - indent
+        self.canvas.drawString(MARGIN_LEFT + indent, self.y,
+                               fit_text(text, self.font_name, self.font_size, width))
+        self.y -= height
+
+    def lines(self, texts, indent=0, height=None):
+        for text in texts:
+            self.line(text, indent=indent, height=height)
+
+    def table(self, columns, rows):
+        # columns - список пар (заголовок, ширина); заголовок повторяется на каждой странице
+        def draw_row(values, bold=False):
+            self._ensure_space(self.line_height)
+            x = MARGIN_LEFT
+            for (_, width), value in zip(columns, values):
+                self.canvas.drawString(x, self.y, fit_text(value, self.font_name, self.font_size, width - 5))
+                x += width
+            if bold:
+                self.canvas.line(MARGIN_LEFT, self.y - 4, x, self.y - 4)
+            self.y -= self.line_height
+
+        def draw_header():
+            draw_row([title for title, _ in columns], bold=True)
+
+        draw_header()
+        self.page_header = draw_header
+        for values in rows:
+            draw_row(values)
+        self.page_header = None
+
+    def save(self):
+        self.canvas.showPage()
+        self.canvas.save()
@@ -0,0 +1,70 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event, select, func, cast, DateTime
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import contains_eager, undefer
+from models import Client, Book, Journal, DataVersion
+
+# Запросы для списков: связанные записи подгружаются сразу, а не отдельным SELECT на каждую строку
+
+def with_availability(query):
+    # Подгружаем число доступных экземпляров вместе с книгами, без отдельного запроса на каждую
+    return query.options(undefer(Book.available))
+
+def clients_query():
+    # Клиенты вместе со сводкой (книги на руках, штрафы), у новых клиентов сводки может не быть
+    return Client.query.outerjoin(Client.summary).options(contains_eager(Client.summary))
+
+def books_query():
+    # Книги вместе с типом книги (для колонок "Тип", "Срок выдачи", "Штраф")
+    return with_availability(
+        Book.query.join(Book.book_type).options(contains_eager(Book.book_type))
+    )
+
+def books_statement():
+    # То же, что books_query(), в виде select() - для асинхронной сессии (asgi.py)
+    return with_availability(
+        select(Book).join(Book.book_type).options(contains_eager(Book.book_type))
+    )
+
+def data_version_statement():
+    # Версия данных для ETag и Last-Modified (одна строка, общая для синхронного и асинхронного режима).
+    # Просрочка и штраф в ответах API считаются на current_date, поэтому ответ меняется и со сменой
+    # даты: она входит в ETag, а Last-Modified не раньше начала текущего дня
+    today = func.current_date()
+    return select(
+        DataVersion.version,
+        func.greatest(DataVersion.updated_at, cast(today, DateTime(timezone=True))).label('updated_at'),
+        today.label('today')
+    ).where(DataVersion.id == 1)
+
+def journal_query():
+    # Записи журнала вместе с клиентом, книгой и штрафом (считается в том же запросе)
+    return Journal.query.join(Journal.client).join(Journal.book).options(
+        contains_eager(Journal.client),
+        contains_eager(Journal.book),
+        undefer(Journal.fine)
+    )
+
+
+# Контроль числа запросов на одну страницу (только в режиме тестирования)
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def init_query_budget(app):
+    app.config.setdefault('QUERY_BUDGET', 10)
+
+    @app.after_request
+    def check_query_budget(response):
+        budget = app.config['QUERY_BUDGET']
+        count = g.get('query_count', 0)
+        if app.testing and budget is not None and count > budget:
+            raise QueryBudgetExceeded(
+                f'{request.endpoint}: {count} SQL-запросов при лимите {budget}'
+            )
+        return response
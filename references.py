@@ -0,0 +1,28 @@
+from collections import namedtuple
+from cache import TTLCache
+from models import BookType
+
+# Справочник типов книг в памяти процесса: типов всего несколько и меняются они редко,
+# а нужны при каждой выдаче (срок возврата) и в формах книг.
+# Маршруты изменения типов книг сбрасывают кэш; в других процессах он обновится через BOOK_TYPE_CACHE_TTL.
+
+BookTypeInfo = namedtuple('BookTypeInfo', ['id', 'type', 'fine', 'day_count'])
+
+book_type_cache = TTLCache(prefix='BOOK_TYPE_CACHE', max_size=1, ttl=300)
+
+def book_type_infos(book_types):
+    return {book_type.id: BookTypeInfo(book_type.id, book_type.type, book_type.fine, book_type.day_count)
+            for book_type in book_types}
+
+def get_book_types():
+    book_types = book_type_cache.get('all')
+    if book_types is None:
+        book_types = book_type_infos(BookType.query.order_by(BookType.id))
+        book_type_cache.set('all', book_types)
+    return book_types
+
+def get_book_type(type_id):
+    return get_book_types().get(type_id)
+
+def invalidate_book_types():
+    book_type_cache.clear()
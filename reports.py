@@ -0,0 +1,141 @@
+import threading
+import time
+from datetime import date
+from sqlalchemy import text, delete, update, select, func
+from sqlalchemy.orm import contains_eager
+from models import db, OverdueSnapshot, Book, BookType, DataVersion
+
+# Показатели отчетов из хранимых функций (migrations/002_report_functions.sql,
+# показатели клиента - из сводки migrations/004_client_summary.sql, просрочки - из снимка
+# migrations/006_overdue_snapshot.sql). Здесь же обслуживание секций журнала.
+
+def get_client_books_count(client_id):
+    return db.session.execute(text('SELECT client_books_on_hand(:client_id)'),
+                              {'client_id': client_id}).scalar()
+
+def get_client_fine(client_id):
+    return db.session.execute(text('SELECT client_fine(:client_id)'),
+                              {'client_id': client_id}).scalar() or 0
+
+def get_max_fine():
+    return db.session.execute(text('SELECT max_fine()')).scalar() or 0
+
+def get_top_books(limit=3):
+    return db.session.execute(text('SELECT name, issue_count FROM top_books(:limit)'),
+                              {'limit': limit}).all()
+
+def reconcile_client_summary():
+    changed = db.session.execute(text('SELECT reconcile_client_summary()')).scalar()
+    db.session.commit()
+    return changed
+
+def refresh_overdue_snapshot():
+    built = db.session.execute(text('SELECT refresh_overdue_snapshot()')).scalar()
+    touch_data_version()
+    db.session.commit()
+    return built
+
+def discard_overdue(journal_ids):
+    # Возвращенные и удаленные записи убираются из снимка просрочек в той же транзакции
+    db.session.execute(delete(OverdueSnapshot).where(OverdueSnapshot.journal_id.in_(journal_ids)))
+
+def reprice_overdue(book_id):
+    # Смена типа книги: штрафы по ее выдачам в снимке пересчитываются по новому тарифу
+    # на ту же дату построения, в той же транзакции
+    fine = select(BookType.fine).join(Book, Book.type_id == BookType.id) \
+        .where(Book.id == book_id).scalar_subquery()
+    db.session.execute(update(OverdueSnapshot).where(OverdueSnapshot.book_id == book_id).values(
+        fine=(OverdueSnapshot.built_on - OverdueSnapshot.date_end) * func.coalesce(fine, 0)
+    ))
+
+def reprice_overdue_type(type_id):
+    # Смена тарифа типа книги: пересчитываются только выдачи книг этого типа (индекс books(type_id)),
+    # без перестроения всего снимка; новый тариф уже записан в той же транзакции
+    fine = select(BookType.fine).where(BookType.id == type_id).scalar_subquery()
+    db.session.execute(update(OverdueSnapshot).where(
+        OverdueSnapshot.book_id.in_(select(Book.id).where(Book.type_id == type_id))
+    ).values(fine=(OverdueSnapshot.built_on - OverdueSnapshot.date_end) * func.coalesce(fine, 0)))
+
+def overdue_snapshot_query():
+    # Просроченные выдачи из снимка вместе с клиентом и книгой, по убыванию штрафа
+    return OverdueSnapshot.query.join(OverdueSnapshot.client).join(OverdueSnapshot.book).options(
+        contains_eager(OverdueSnapshot.client), contains_eager(OverdueSnapshot.book)
+    ).order_by(OverdueSnapshot.fine.desc(), OverdueSnapshot.journal_id)
+
+def overdue_snapshot_totals():
+    return db.session.query(
+        func.count(OverdueSnapshot.journal_id).label('count'),
+        func.coalesce(func.sum(OverdueSnapshot.fine), 0).label('fines'),
+        func.max(OverdueSnapshot.built_on).label('built_on')
+    ).one()
+
+def create_journal_partitions(year_from, year_to):
+    created = db.session.execute(text('SELECT journal_create_partitions(:year_from, :year_to)'),
+                                 {'year_from': year_from, 'year_to': year_to}).scalar()
+    db.session.commit()
+    return created
+
+def create_journal_partitions_ahead(today=None):
+    # Секции на текущий и следующий год: новые выдачи не должны попадать в секцию DEFAULT
+    today = today or date.today()
+    return create_journal_partitions(today.year, today.year + 1)
+
+def archive_journal(before, batch_size=10000):
+    # Перенос в архивные секции журнала порциями, каждая порция в своей транзакции,
+    # чтобы не держать блокировки на всем журнале (migrations/007_journal_partitions.sql)
+    archived = 0
+    while True:
+        moved = db.session.execute(text('SELECT archive_journal(:before, :limit)'),
+                                   {'before': before, 'limit': batch_size}).scalar()
+        db.session.commit()
+        archived += moved
+        if moved < batch_size:
+            return archived
+
+def touch_data_version():
+    # Представления отчетов и снимок просрочек обновляются отдельно от самих данных: версия
+    # увеличивается и после их обновления, иначе готовые отчеты по старым представлениям
+    # остались бы в кэше (migrations/009_data_version.sql)
+    db.session.execute(update(DataVersion).where(DataVersion.id == 1).values(
+        version=DataVersion.version + 1, updated_at=func.clock_timestamp()
+    ))
+
+def refresh_report_views():
+    db.session.execute(text('SELECT refresh_report_views()'))
+    touch_data_version()
+    db.session.commit()
+
+class ReportViewsRefresher:
+    # Обновляет материализованные представления в фоне после изменений журнала.
+    # Изменения за REPORT_VIEWS_REFRESH_DELAY секунд объединяются в одно обновление.
+
+    def __init__(self, app=None):
+        self.app = None
+        self._stale = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('REPORT_VIEWS_REFRESH_DELAY', 30)
+
+    def mark_stale(self):
+        self._stale.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='report-views-refresher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._stale.wait()
+            time.sleep(self.app.config['REPORT_VIEWS_REFRESH_DELAY'])
+            self._stale.clear()
+            with self.app.app_context():
+                try:
+                    refresh_report_views()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Не удалось обновить представления отчетов')
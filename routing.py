@@ -0,0 +1,16 @@
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+# Сессия, которая в маршрутах только для чтения отправляет запросы на реплику.
+# Реплика задается bind-ключом 'replica' (секция [replica] в config/database.ini);
+# если она не настроена, все запросы идут в основную базу.
+
+REPLICA_BIND = 'replica'
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get('use_replica'):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,131 @@
+from sqlalchemy import func, or_, text, select, any_, cast, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql.elements import Grouping
+from models import db, Client, Book, BookType, Journal
+from queries import with_availability, books_statement
+from pagination import keyset_statement
+
+# Поиск подстроки (ILIKE '%текст%') по колонкам с триграммными GIN-индексами (расширение pg_trgm).
+# PostgreSQL использует такие индексы для ILIKE сам, поэтому запрос остается прежним,
+# а на больших таблицах вместо полного просмотра идет выборка по индексу.
+
+CLIENT_SEARCH_FIELDS = ['last_name', 'first_name', 'father_name', 'passport_seria', 'passport_number']
+
+def search_filter(search_text, columns):
+    return or_(*[column.ilike(f'%{search_text}%') for column in columns])
+
+# Колонки поиска по журналу: клиент и книга
+JOURNAL_SEARCH_COLUMNS = [Client.last_name, Client.first_name, Book.name]
+
+def journal_search_filter(search_text):
+    # Клиенты и книги ищутся отдельно по своим триграммным индексам, найденные id собираются в массив
+    # (вычисляется один раз), а записи журнала выбираются по индексам journal(client_id) и journal(book_id).
+    # Условие OR по колонкам двух присоединенных таблиц PostgreSQL выполнил бы только обходом всего журнала.
+    client_ids = select(func.array_agg(Client.id)).where(
+        search_filter(search_text, [Client.last_name, Client.first_name])
+    ).scalar_subquery()
+    book_ids = select(func.array_agg(Book.id)).where(search_filter(search_text, [Book.name])).scalar_subquery()
+    # CAST делает подзапрос выражением-массивом: = ANY (подзапрос) сравнивал бы с каждой его строкой
+    return or_(Journal.client_id == any_(cast(client_ids, ARRAY(Integer))),
+               Journal.book_id == any_(cast(book_ids, ARRAY(Integer))))
+
+# Колонки поиска по каталогу: название и тип книги
+BOOK_SEARCH_COLUMNS = [Book.name, BookType.type]
+
+def book_search_filter(search_text):
+    # Как journal_search_filter: подходящие типы ищутся отдельно (один раз), книги этих типов выбираются
+    # по индексу books(type_id), название - по триграммному индексу (migrations/010_book_type_index.sql).
+    # Условие OR по колонкам книги и присоединенного справочника читало бы все книги.
+    type_ids = select(func.array_agg(BookType.id)).where(
+        search_filter(search_text, [BookType.type])
+    ).scalar_subquery()
+    return or_(search_filter(search_text, [Book.name]), Book.type_id == any_(cast(type_ids, ARRAY(Integer))))
+
+def catalog_page_statement(search_text, after=None, limit=20):
+    # Страница каталога для JSON API (app.api_catalog и асинхронный режим asgi.py): книги по id
+    # после курсора after, строки и курсор следующей страницы - pagination.keyset_page
+    statement = books_statement()
+    if search_text:
+        statement = statement.where(book_search_filter(search_text))
+    return keyset_statement(statement, Book.id, Book.id, after, limit)
+
+def order_by_relevance(query, search_text, columns):
+    # Сначала записи, в которых искомый текст похож на слово целиком (word_similarity из pg_trgm)
+    if db.engine.dialect.name != 'postgresql':
+        return query
+    rank = func.greatest(*[
+        func.coalesce(func.word_similarity(search_text, column), 0) for column in columns
+    ])
+    return query.order_by(rank.desc())
+
+def create_search_indexes():
+    # Индексы для уже существующей базы (для новой их создает db.create_all)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.commit()
+    for model in (Client, Book):
+        for index in model.__table__.indexes:
+            if index.name.endswith('_trgm'):
+                index.create(db.engine, checkfirst=True)
+
+
+# Подсказки по началу строки для формы выдачи (индексы из migrations/011_lookup_order_indexes.sql).
+# Запросы собираются отдельно от выполнения, чтобы их же выполнял асинхронный режим (asgi.py).
+# Возвращается не больше LOOKUP_MAX_LIMIT записей, поэтому время ответа не зависит от размера таблиц.
+
+LOOKUP_LIMIT = 10
+LOOKUP_MAX_LIMIT = 50
+
+def lookup_key(expression):
+    # Подсказки сортируются побайтово, как в индексах migrations/011_lookup_order_indexes.sql:
+    # индекс отдает первые LIMIT совпадений уже упорядоченными. Скобки нужны для склейки
+    # серии и номера паспорта: без них COLLATE относится только к номеру
+    return Grouping(expression).collate('C')
+
+def prefix_pattern(text):
+    # Экранируем спецсимволы LIKE, чтобы % и _ в запросе искались как обычные символы
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def client_lookup_statement(text, limit=LOOKUP_LIMIT):
+    words = text.split()
+    if not words:
+        return None
+    digits = ''.join(words)
+    if digits.isdigit():
+        # Серия и номер паспорта подряд или через пробел
+        passport = lookup_key(Client.passport_seria.concat(Client.passport_number))
+        return select(Client).where(passport.like(prefix_pattern(digits))) \
+            .order_by(passport, Client.id).limit(limit)
+    last_name = lookup_key(func.lower(Client.last_name))
+    statement = select(Client).where(last_name.like(prefix_pattern(words[0].lower())))
+    if len(words) > 1:
+        statement = statement.where(func.lower(Client.first_name).like(prefix_pattern(words[1].lower())))
+    return statement.order_by(last_name, Client.id).limit(limit)
+
+def book_lookup_statement(text, limit=LOOKUP_LIMIT):
+    # Только книги, которые есть в наличии
+    text = text.strip()
+    if not text:
+        return None
+    name = lookup_key(func.lower(Book.name))
+    return with_availability(select(Book)).where(
+        name.like(prefix_pattern(text.lower())),
+        Book.available > 0
+    ).order_by(name, Book.id).limit(limit)
+
+def lookup_clients(text, limit=LOOKUP_LIMIT):
+    statement = client_lookup_statement(text, limit)
+    return db.session.scalars(statement).all() if statement is not None else []
+
+def lookup_books(text, limit=LOOKUP_LIMIT):
+    statement = book_lookup_statement(text, limit)
+    return db.session.scalars(statement).all() if statement is not None else []
+
+def client_label(client):
+    return (f'{client.last_name} {client.first_name} {client.father_name} '
+            f'({client.passport_seria}-{client.passport_number})')
+
+def book_label(book, book_type):
+    if book_type is None:
+        return f'{book.name} (доступно: {book.available})'
+    return f'{book.name} ({book_type.type}, срок: {book_type.day_count} дней, доступно: {book.available})'
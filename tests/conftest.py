@@ -0,0 +1,51 @@
+import os
+import pytest
+from sqlalchemy import text
+
+# Тесты с PostgreSQL работают с базой из переменной окружения TEST_DATABASE_URL, например
+# TEST_DATABASE_URL=postgresql://postgres@localhost/library_test python -m pytest
+# Схема public этой базы пересоздается целиком. Без переменной такие тесты пропускаются.
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+
+def reset_schema(connection):
+    connection.execute(text('DROP SCHEMA public CASCADE'))
+    connection.execute(text('CREATE SCHEMA public'))
+    connection.execute(text('CREATE EXTENSION pg_trgm'))
+
+@pytest.fixture(scope='session')
+def pg_app():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL не задан')
+    from app import app
+    from models import db, User
+    from migrations import apply_migrations
+    from benchmark import generate_library
+    from reports import refresh_report_views, refresh_overdue_snapshot
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        with db.engine.begin() as connection:
+            reset_schema(connection)
+        db.create_all()
+        apply_migrations()
+        admin = User(username='admin', role='admin')
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.commit()
+        generate_library(clients=500, books=300, loans=5000)
+        refresh_report_views()
+        refresh_overdue_snapshot()
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def pg_client(pg_app):
+    client = pg_app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
@@ -0,0 +1,17 @@
+from datetime import date
+
+def test_conditional_get(pg_client):
+    response = pg_client.get('/api/catalog')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Vary'] == 'Cookie'
+
+    response = pg_client.get('/api/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['Vary'] == 'Cookie'
+    assert response.headers['ETag'] == etag
+
+def test_etag_changes_with_date(pg_client):
+    # Просрочка и штраф в /api/clients/<id>/loans считаются на текущую дату
+    etag = pg_client.get('/api/clients/1/loans').headers['ETag']
+    assert etag.endswith(f'-{date.today():%Y%m%d}"')
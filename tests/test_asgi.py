@@ -0,0 +1,51 @@
+import asyncio
+from urllib.parse import urlencode
+
+async def asgi_get(application, path, query_string, cookie):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode(),
+             'root_path': '', 'scheme': 'http', 'server': ('localhost', 80), 'client': ('127.0.0.1', 1),
+             'http_version': '1.1', 'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())]}
+    response = {'body': b''}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['body'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    return response
+
+def run(asgi, coroutine):
+    # Асинхронный движок привязан к циклу событий, после теста он закрывается в том же цикле
+    async def run_and_dispose():
+        try:
+            await coroutine
+        finally:
+            if asgi._engine is not None:
+                await asgi._engine.dispose()
+            asgi._engine = asgi._sessionmaker = None
+    asyncio.run(run_and_dispose())
+
+def test_async_catalog_matches_sync(pg_client, monkeypatch):
+    import asgi
+    # Ответ должен дать асинхронный обработчик, а не Flask через WsgiToAsgi
+    monkeypatch.setattr(asgi, 'wsgi_application', None)
+    cookie = f"session={pg_client.get_cookie('session').value}"
+    next_cursor = pg_client.get('/api/catalog', query_string={'limit': 5}).json['next']
+    query_strings = [urlencode(args) for args in [
+        {'limit': 5}, {'limit': 5, 'after': next_cursor}, {'limit': 5, 'search': 'война'},
+        {'fields': 'id,name', 'limit': 3},
+    ]]
+
+    async def compare():
+        for query_string in query_strings:
+            response = await asgi_get(asgi.application, '/api/catalog', query_string, cookie)
+            expected = pg_client.get(f'/api/catalog?{query_string}')
+            assert response['status'] == expected.status_code == 200
+            assert response['body'] == expected.data, query_string
+
+    run(asgi, compare())
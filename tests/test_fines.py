@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import func
+from models import db, Journal, ClientSummary, Book, BookType, OverdueSnapshot
+from reports import get_client_fine, get_max_fine
+
+TODAY = date.today()
+
+@pytest.mark.parametrize('date_end, date_ret, days', [
+    (TODAY - timedelta(days=5), TODAY, 5),
+    (TODAY, TODAY - timedelta(days=1), 0),
+    (TODAY - timedelta(days=5), None, 0),
+])
+def test_days_overdue(date_end, date_ret, days):
+    assert Journal(date_end=date_end, date_ret=date_ret).days_overdue == days
+
+def test_journal_fine_matches_client_summary(pg_app):
+    with pg_app.app_context():
+        journal_fines = dict(db.session.query(Journal.client_id, func.sum(Journal.fine))
+                             .group_by(Journal.client_id).all())
+        summary_fines = dict(db.session.query(ClientSummary.client_id, ClientSummary.fines).all())
+        assert {key: value for key, value in journal_fines.items() if value} == \
+            {key: value for key, value in summary_fines.items() if value}
+        client_id = max(summary_fines, key=summary_fines.get)
+        assert get_client_fine(client_id) == journal_fines[client_id]
+        assert get_max_fine() == db.session.query(func.max(Journal.fine)).scalar()
+        db.session.rollback()
+
+def test_type_fine_change_reprices_snapshot(pg_app, pg_client):
+    with pg_app.app_context():
+        type_id, book_type, fine, day_count = db.session.query(
+            Book.type_id, BookType.type, BookType.fine, BookType.day_count
+        ).join(Book.book_type).join(OverdueSnapshot, OverdueSnapshot.book_id == Book.id).first()
+        other_fines = dict(db.session.query(OverdueSnapshot.journal_id, OverdueSnapshot.fine)
+                           .join(Book, Book.id == OverdueSnapshot.book_id).filter(Book.type_id != type_id).all())
+        db.session.rollback()
+
+    def edit(new_fine):
+        response = pg_client.post(f'/book_types/{type_id}/edit',
+                                  data={'type': book_type, 'fine': new_fine, 'day_count': day_count})
+        assert response.status_code == 302
+
+    edit(fine + 7)
+    try:
+        with pg_app.app_context():
+            rows = db.session.query(OverdueSnapshot, Book.type_id).join(Book, Book.id == OverdueSnapshot.book_id).all()
+            for entry, entry_type_id in rows:
+                if entry_type_id == type_id:
+                    assert entry.fine == (entry.built_on - entry.date_end).days * (fine + 7)
+                else:
+                    assert entry.fine == other_fines[entry.journal_id]
+            db.session.rollback()
+    finally:
+        edit(fine)
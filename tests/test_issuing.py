@@ -0,0 +1,37 @@
+from datetime import date
+import pytest
+from sqlalchemy import update
+from models import db, Client, ClientSummary, Book, Journal
+from issuing import MAX_CLIENT_BOOKS, issue_books
+
+@pytest.fixture
+def library(pg_app):
+    with pg_app.app_context():
+        clients = [Client(last_name='Тестов', first_name=f'Клиент{i}', father_name='Т',
+                          passport_seria='0000', passport_number=f'99999{i}') for i in range(2)]
+        books = [Book(name=f'Тестовая книга {i}', cnt=MAX_CLIENT_BOOKS + 1, type_id=1) for i in range(2)]
+        db.session.add_all(clients + books)
+        db.session.commit()
+        client_ids = [client.id for client in clients]
+        book_ids = [book.id for book in books]
+    yield client_ids, book_ids
+    with pg_app.app_context():
+        Journal.query.filter(Journal.client_id.in_(client_ids)).delete()
+        Client.query.filter(Client.id.in_(client_ids)).delete()
+        Book.query.filter(Book.id.in_(book_ids)).delete()
+        db.session.commit()
+
+def test_trigger_rejection_is_reported_per_item(pg_app, library):
+    (full_client, other_client), (book, other_book) = library
+    with pg_app.app_context():
+        results = issue_books([(full_client, book)] * MAX_CLIENT_BOOKS, date.today())
+        assert all(result['ok'] for result in results)
+        # Сводка разошлась с журналом: проверка в Python пропустит выдачу, триггер ее отклонит
+        db.session.execute(update(ClientSummary).where(ClientSummary.client_id == full_client)
+                           .values(open_loans=0))
+        db.session.commit()
+
+        results = issue_books([(full_client, other_book), (other_client, other_book)], date.today())
+        assert [result['ok'] for result in results] == [False, True]
+        assert 'больше 10 книг' in results[0]['error']
+        assert results[1]['journal_id']
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+import pytest
+from models import Book, BookType, Journal
+from pagination import encode_cursor, decode_cursor
+
+def raw_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+@pytest.mark.parametrize('column, value', [
+    (Book.id, 5),
+    (Book.name, 'Война и мир'),
+    (Journal.date_beg, date(2024, 1, 31)),
+    (BookType.fine, Decimal('12.50')),
+    (Book.name, None),
+])
+def test_round_trip(column, value):
+    assert decode_cursor(encode_cursor(value, 7), column) == (value, 7)
+
+@pytest.mark.parametrize('cursor, column', [
+    ('не base64', Book.id),
+    ('!!!', Book.id),
+    (raw_cursor([1]), Book.id),
+    (raw_cursor(5), Book.id),
+    (raw_cursor([1, 'x']), Book.id),
+    (raw_cursor([1, True]), Book.id),
+    (raw_cursor([1, 2.5]), Book.id),
+    (raw_cursor(['1; DROP TABLE books', 2]), Book.id),
+    (raw_cursor([True, 2]), Book.id),
+    (raw_cursor([{'a': 1}, 2]), Book.name),
+    (raw_cursor([5, 2]), Book.name),
+    (raw_cursor(['2024-13-01', 2]), Journal.date_beg),
+    (raw_cursor([20240101, 2]), Journal.date_beg),
+    (raw_cursor(['много', 2]), BookType.fine),
+    (raw_cursor(['NaN', 2]), BookType.fine),
+    (raw_cursor([[1], 2]), BookType.fine),
+])
+def test_invalid_cursor_starts_from_first_page(cursor, column):
+    assert decode_cursor(cursor, column) is None
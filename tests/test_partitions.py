@@ -0,0 +1,33 @@
+from sqlalchemy import text
+from models import db, Journal, ClientSummary
+from reports import create_journal_partitions
+
+YEAR = 2015
+
+def partition_counts():
+    return dict(db.session.execute(text(
+        'SELECT tableoid::regclass::text, count(*) FROM journal WHERE date_beg < :end GROUP BY 1'
+    ), {'end': f'{YEAR + 1}-01-01'}).all())
+
+def client_summary():
+    return db.session.query(ClientSummary.open_loans, ClientSummary.fines).filter_by(client_id=1).one()
+
+def test_rows_move_from_default_partition(pg_app):
+    with pg_app.app_context():
+        db.session.add_all([Journal(client_id=1, book_id=1, date_beg=f'{YEAR}-03-01', date_end=f'{YEAR}-04-01',
+                                    date_ret=f'{YEAR}-04-11', archived=archived)
+                            for archived in (False, False, True)])
+        db.session.commit()
+        assert partition_counts() == {'journal_hot_default': 2, 'journal_archive_default': 1}
+        summary = client_summary()
+
+        assert create_journal_partitions(YEAR, YEAR) == 2
+        assert partition_counts() == {f'journal_hot_{YEAR}': 2, f'journal_archive_{YEAR}': 1}
+        # Перенос между секциями не считается новыми выдачами
+        assert client_summary() == summary
+        assert create_journal_partitions(YEAR, YEAR) == 0
+
+        Journal.query.filter(Journal.date_beg < f'{YEAR + 1}-01-01').delete()
+        db.session.commit()
+        db.session.execute(text(f'DROP TABLE journal_hot_{YEAR}, journal_archive_{YEAR}'))
+        db.session.commit()
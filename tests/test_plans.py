@@ -0,0 +1,8 @@
+from explain import check_plans, hot_queries
+
+def test_hot_queries_use_indexes(pg_app):
+    with pg_app.app_context():
+        results = check_plans()
+    assert [result['query'] for result in results] == [name for name, _ in hot_queries()]
+    assert {result['query']: result['seq_scans'] for result in results if result['seq_scans']} == {}
+    assert {result['query']: result['archive_scans'] for result in results if result['archive_scans']} == {}
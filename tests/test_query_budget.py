@@ -0,0 +1,33 @@
+import pytest
+from flask import g, request_finished
+from queries import QueryBudgetExceeded
+
+@pytest.fixture
+def query_counts(pg_app):
+    counts = []
+
+    def remember(sender, response, **extra):
+        counts.append(g.get('query_count', 0))
+
+    request_finished.connect(remember, pg_app)
+    yield counts
+    request_finished.disconnect(remember, pg_app)
+
+@pytest.mark.parametrize('path, query_string', [
+    ('/journal', {}),
+    ('/journal', {'page': 2}),
+    ('/journal', {'search': 'иван'}),
+    ('/books', {}),
+    ('/books', {'page': 2}),
+    ('/catalog', {}),
+    ('/catalog', {'search': 'война'}),
+])
+def test_grid_pages_fit_query_budget(pg_app, pg_client, query_counts, path, query_string):
+    response = pg_client.get(path, query_string=query_string)
+    assert response.status_code == 200
+    assert 0 < query_counts[-1] <= pg_app.config['QUERY_BUDGET']
+
+def test_query_budget_is_enforced(pg_app, pg_client, monkeypatch):
+    monkeypatch.setitem(pg_app.config, 'QUERY_BUDGET', 1)
+    with pytest.raises(QueryBudgetExceeded):
+        pg_client.get('/journal')
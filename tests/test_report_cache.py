@@ -0,0 +1,31 @@
+from sqlalchemy import create_engine, text
+from conftest import TEST_DATABASE_URL
+
+def test_report_cache_follows_database_version(pg_app):
+    from app import report_cache
+    calls = []
+    def compute():
+        calls.append(1)
+        return f'report {len(calls)}'
+
+    with pg_app.test_request_context():
+        assert report_cache.get_or_compute('test_report', compute) == 'report 1'
+    with pg_app.test_request_context():
+        assert report_cache.get_or_compute('test_report', compute) == 'report 1'
+
+    # Изменение из другого процесса: отдельное подключение мимо приложения
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.begin() as connection:
+        connection.execute(text('UPDATE books SET cnt = cnt WHERE id = 1'))
+    engine.dispose()
+    with pg_app.test_request_context():
+        assert report_cache.get_or_compute('test_report', compute) == 'report 2'
+
+def test_views_refresh_changes_version(pg_app):
+    from app import data_version
+    from reports import refresh_report_views
+    with pg_app.app_context():
+        version = data_version().version
+    with pg_app.app_context():
+        refresh_report_views()
+        assert data_version().version == version + 1
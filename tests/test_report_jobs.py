@@ -0,0 +1,56 @@
+import os
+import threading
+import pytest
+from sqlalchemy import update, func, text
+from models import db, ReportJob
+from jobs import ReportJobs, DONE, FAILED
+
+@pytest.fixture
+def jobs(pg_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(pg_app.config, 'REPORT_JOB_DIR', str(tmp_path))
+    yield ReportJobs(pg_app)
+    with pg_app.app_context():
+        ReportJob.query.delete()
+        db.session.commit()
+
+def wait_done(jobs, job_id):
+    jobs.executor.shutdown(wait=True)
+    jobs._executor = None
+    return jobs.get(job_id)
+
+def test_job_state_is_shared_between_processes(pg_app, jobs):
+    # Второй экземпляр ReportJobs - другой процесс приложения со своим пулом потоков
+    other = ReportJobs(pg_app)
+    started = threading.Event()
+
+    def render():
+        started.wait(5)
+        return 'отчет'
+
+    with pg_app.app_context():
+        job = jobs.submit(('report', 1), render, 'report.csv', 'text/csv')
+        job_id = job.id
+        assert other.submit(('report', 1), lambda: 'другой', 'report.csv', 'text/csv').id == job_id
+        started.set()
+        job = wait_done(jobs, job_id)
+        assert job.status == DONE
+        job = other.get(job_id)
+        with open(job.path, encoding='utf-8') as f:
+            assert f.read() == 'отчет'
+
+def test_expired_jobs_are_removed_on_poll(pg_app, jobs):
+    with pg_app.app_context():
+        job_id = jobs.submit(('report', 2), lambda: 'отчет', 'report.csv', 'text/csv').id
+        path = wait_done(jobs, job_id).path
+        assert os.path.exists(path)
+        db.session.execute(update(ReportJob).values(finished_at=func.now() - text("interval '1 day'")))
+        db.session.commit()
+        assert jobs.get(job_id) is None
+        assert not os.path.exists(path)
+
+def test_interrupted_jobs_fail(pg_app, jobs):
+    with pg_app.app_context():
+        db.session.add(ReportJob(id='interrupted', key='report', status='running', download_name='report.csv',
+                                 mimetype='text/csv', created_at=func.now() - text("interval '1 day'")))
+        db.session.commit()
+        assert jobs.get('interrupted').status == FAILED
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from conftest import TEST_DATABASE_URL, reset_schema
+from models import db, Book, BookType
+from routing import REPLICA_BIND
+
+REPLICA_BOOK = 'Книга только на реплике'
+PRIMARY_BOOK = 'Книга только в основной базе'
+
+@pytest.fixture
+def replica(pg_app):
+    # Вторая база на том же сервере играет роль реплики: данные в ней отличаются от основной
+    url = make_url(TEST_DATABASE_URL)
+    replica_url = url.set(database=f'{url.database}_replica')
+    admin = create_engine(url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as connection:
+        exists = connection.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                                    {'name': replica_url.database}).scalar()
+        if not exists:
+            connection.execute(text(f'CREATE DATABASE "{replica_url.database}"'))
+    admin.dispose()
+
+    engine = create_engine(replica_url)
+    with engine.begin() as connection:
+        reset_schema(connection)
+        db.metadata.create_all(connection)
+        book_type = connection.execute(BookType.__table__.insert().returning(BookType.id),
+                                       {'type': 'обычная', 'fine': 10, 'day_count': 60}).scalar()
+        connection.execute(Book.__table__.insert(), {'name': REPLICA_BOOK, 'cnt': 1, 'type_id': book_type})
+    with pg_app.app_context():
+        db.engines[REPLICA_BIND] = engine
+    yield engine
+    with pg_app.app_context():
+        db.engines.pop(REPLICA_BIND)
+        Book.query.filter_by(name=PRIMARY_BOOK).delete()
+        db.session.commit()
+    engine.dispose()
+
+def test_read_only_views_read_from_replica(replica, pg_client):
+    page = pg_client.get('/books', query_string={'search': 'Книга только'}).get_data(as_text=True)
+    assert REPLICA_BOOK in page
+
+def test_writes_go_to_primary(replica, pg_app, pg_client):
+    response = pg_client.post('/books/add', data={'name': PRIMARY_BOOK, 'cnt': 1, 'type_id': 1})
+    assert response.status_code == 302
+    with pg_app.app_context():
+        assert Book.query.filter_by(name=PRIMARY_BOOK).count() == 1
+        assert Book.query.filter_by(name=REPLICA_BOOK).count() == 0
+    with replica.connect() as connection:
+        assert connection.execute(text('SELECT count(*) FROM books WHERE name = :name'),
+                                  {'name': PRIMARY_BOOK}).scalar() == 0
+    # Список книг читается с реплики, новой книги там нет
+    page = pg_client.get('/books', query_string={'search': 'Книга только'}).get_data(as_text=True)
+    assert REPLICA_BOOK in page and PRIMARY_BOOK not in page
+
+def test_without_replica_reads_from_primary(pg_app, pg_client):
+    with pg_app.app_context():
+        assert REPLICA_BIND not in db.engines
+        name = Book.query.order_by(Book.id).first().name
+    page = pg_client.get('/books', query_string={'search': name}).get_data(as_text=True)
+    assert name in page
+
+def statement_timeout():
+    return int(db.session.execute(text("SELECT setting FROM pg_settings WHERE name = 'statement_timeout'")).scalar())
+
+def test_statement_timeout_only_in_requests(pg_app):
+    from app import config
+    with pg_app.test_request_context():
+        assert statement_timeout() == config.getint('pool', 'statement_timeout', fallback=30000)
+        db.session.rollback()
+    with pg_app.app_context():
+        assert statement_timeout() == 0
+        db.session.rollback()
@@ -0,0 +1,8 @@
+from issuing import run_stress
+
+def test_parallel_issues_keep_limits(pg_app):
+    # Экземпляров меньше, чем потоков: часть выдач должна отклоняться триггером, а не проходить
+    results = run_stress(pg_app, threads=6, issues_per_thread=10, copies=3, clients_count=8)
+    assert results['ok'], results
+    assert results['issued'] > 0 and results['rejected'] > 0
+    assert results['on_hand'] <= results['copies']
@@ -0,0 +1,36 @@
+from models import db, User
+
+def test_changed_user_leaves_cache_after_commit(pg_app):
+    from app import user_cache, load_user
+    with pg_app.app_context():
+        user = User(username='cached', role='admin')
+        user.set_password('cached')
+        db.session.add(user)
+        db.session.commit()
+        user_id = str(user.id)
+        assert load_user(user_id).role == 'admin'
+
+        user.role = 'user'
+        db.session.flush()
+        # Параллельный запрос между flush и commit читает еще не измененную строку
+        user_cache.set(user_id, {'id': user.id, 'username': 'cached',
+                                 'password_hash': user.password_hash, 'role': 'admin'})
+        db.session.commit()
+        assert user_cache.get(user_id) is None
+        assert load_user(user_id).role == 'user'
+
+        db.session.delete(user)
+        db.session.commit()
+        assert load_user(user_id) is None
+
+def test_rolled_back_changes_keep_cache(pg_app):
+    from app import user_cache, load_user
+    with pg_app.app_context():
+        user = User.query.filter_by(username='admin').one()
+        user_id = str(user.id)
+        load_user(user_id)
+        user.role = 'user'
+        db.session.flush()
+        db.session.rollback()
+        assert 'changed_users' not in db.session.info
+        assert user_cache.get(user_id)['role'] == 'admin'
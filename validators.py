@@ -0,0 +1,38 @@
+import re
+
+# Паттерн для проверки кириллицы
+CYRILLIC_PATTERN = re.compile(r'^[А-Яа-яЁё\s-]+$')
+
+def validate_client(last_name, first_name, father_name, passport_seria, passport_number):
+    # Возвращает текст ошибки или None, если данные клиента корректны
+    
+    # Валидация ФИО
+    if max(len(last_name), len(first_name), len(father_name or '')) > 50:
+        return 'Фамилия, имя и отчество должны быть не длиннее 50 символов'
+        
+    if not CYRILLIC_PATTERN.match(last_name):
+        return 'Фамилия должна содержать только кириллицу'
+        
+    if not CYRILLIC_PATTERN.match(first_name):
+        return 'Имя должно содержать только кириллицу'
+        
+    if father_name and not CYRILLIC_PATTERN.match(father_name):
+        return 'Отчество должно содержать только кириллицу'
+    
+    # Валидация паспортных данных
+    if len(passport_seria) != 4 or not passport_seria.isdigit():
+        return 'Серия паспорта должна состоять из 4 цифр'
+        
+    if len(passport_number) != 6 or not passport_number.isdigit():
+        return 'Номер паспорта должен состоять из 6 цифр'
+    
+    return None
+
+def validate_book(name, cnt):
+    if not name or len(name) > 100:
+        return 'Название книги должно быть от 1 до 100 символов'
+    
+    if not cnt.isdigit():
+        return 'Количество экземпляров должно быть неотрицательным целым числом'
+    
+    return None